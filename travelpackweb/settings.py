@@ -11,6 +11,9 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 """
 
 import os
+import tempfile
+
+from travelpackweb.database import databases_from_env
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -42,7 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'website.instrumentation.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'website.db_routing.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -55,7 +60,8 @@ ROOT_URLCONF = 'travelpackweb.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing each render for website.instrumentation.
+        'BACKEND': 'website.instrumentation.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -65,6 +71,7 @@ TEMPLATES = [
                 'django.template.context_processors.media',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'website.context_processors.cart',
             ],
         },
     },
@@ -76,12 +83,36 @@ WSGI_APPLICATION = 'travelpackweb.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+# Configured from DATABASE_URL, DATABASE_REPLICA_URLS and DATABASE_CONN_MAX_AGE
+# (see travelpackweb/database.py); without them, db.sqlite3 next to manage.py.
+
+DATABASES, DATABASE_REPLICAS = databases_from_env(os.environ, os.path.join(BASE_DIR, 'db.sqlite3'))
+
+# Writes always go to the primary. Reads of the REPLICA_READ_VIEWS go to a replica,
+# unless the visitor sent a POST (or other write) in the last REPLICA_PIN_SECONDS.
+DATABASE_ROUTERS = ['website.db_routing.PrimaryReplicaRouter']
+REPLICA_READ_VIEWS = ('website:list_trips', 'website:search', 'website:trip_reviews')
+REPLICA_PIN_SECONDS = 10
+
+# SQLite tuning
+# The SQLite backend (travelpackweb/sqlite3) runs SQLITE_PRAGMAS on every new
+# connection. WAL lets reads carry on during writes; synchronous=NORMAL is safe
+# with WAL and only fsyncs at checkpoints; writers wait busy_timeout ms for the
+# write lock; mmap_size and a negative cache_size (KiB) keep more of the
+# database in memory. SQLITE_IMMEDIATE_TRANSACTIONS takes the write lock when
+# an atomic block starts, so concurrent checkouts wait instead of failing.
+# SQLITE_PRAGMAS = {} and SQLITE_IMMEDIATE_TRANSACTIONS = False give SQLite's
+# defaults; compare the two with `python manage.py benchmark_sqlite`.
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
 }
+SQLITE_IMMEDIATE_TRANSACTIONS = True
 
 
 # Password validation
@@ -121,5 +152,146 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.11/howto/static-files/
 
 STATIC_URL = '/static/'
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# `python manage.py build_assets` fingerprints and precompresses both roots;
+# see website/assets.py. Fingerprinted URLs are cached for ASSETS_IMMUTABLE_MAX_AGE seconds.
+STATICFILES_STORAGE = 'website.assets.FingerprintedStaticStorage'
+DEFAULT_FILE_STORAGE = 'website.assets.FingerprintedMediaStorage'
+ASSETS_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+# Trip search
+# 'fts5' uses a SQLite FTS5 table; 'python' (and any non-SQLite database) uses
+# the TripSearchTerm inverted index. See website/search.py.
+
+TRIP_SEARCH_BACKEND = 'fts5'
+TRIP_SEARCH_RESULT_LIMIT = 100
+
+
+# All Trips listing
+# Pages are keyset-paginated; with TRIP_LIST_STREAMING (or ?stream=1) the whole
+# catalog is streamed, TRIP_LIST_STREAM_CHUNK_SIZE trips per rendered chunk.
+
+TRIP_LIST_PAGE_SIZE = 24
+TRIP_LIST_MAX_PAGE_SIZE = 120
+TRIP_LIST_STREAMING = False
+TRIP_LIST_STREAM_CHUNK_SIZE = 200
+
+
+# Trip reviews
+# A trip's first page of reviews is cached for TRIP_REVIEWS_CACHE_TIMEOUT seconds
+# and invalidated whenever one of its reviews changes.
+
+TRIP_REVIEWS_PAGE_SIZE = 20
+TRIP_REVIEWS_CACHE_TIMEOUT = 60 * 60
+
+
+# Seat reservations
+# Adding a trip to a cart holds a seat for TRIP_RESERVATION_TTL seconds.
+# Run `python manage.py sweep_reservations` periodically to free expired holds.
+
+TRIP_RESERVATION_TTL = 15 * 60
+
+
+# Trip image renditions
+# Card and hero renditions are generated after upload on a pool of
+# TRIP_IMAGE_WORKERS threads (inline when TRIP_IMAGE_RENDITIONS_ASYNC is False).
+# Backfill existing trips with `python manage.py generate_trip_renditions`.
+
+TRIP_IMAGE_WORKERS = 2
+TRIP_IMAGE_RENDITIONS_ASYNC = True
+
+
+# Caches
+# 'thumbnails' holds sorl-thumbnail's metadata. It should be shared by every
+# worker on the host (or across hosts -- point it at memcached/redis then).
+# 'catalog' holds cached catalog pages and trip cards (see website/catalog_cache.py).
+# Local memory is per process, so with several workers use a shared backend:
+#   'django.core.cache.backends.filebased.FileBasedCache' with a LOCATION directory,
+#   'django.core.cache.backends.memcached.MemcachedCache', or a Redis backend such
+#   as 'django_redis.cache.RedisCache' with LOCATION 'redis://127.0.0.1:6379/1'.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'thumbnails': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'travelpack-thumbnails'),
+        'TIMEOUT': None,
+    },
+}
+
+
+# Thumbnails
+# sorl-thumbnail looks thumbnails up in a per-process LRU first, then the
+# 'thumbnails' cache, then the database. See website/thumbnails.py. Fill the
+# store after a deploy with `python manage.py warm_thumbnails`.
+
+THUMBNAIL_KVSTORE = 'website.thumbnails.KVStore'
+THUMBNAIL_CACHE = 'thumbnails'
+THUMBNAIL_LOCAL_CACHE_MAX_ENTRIES = 5000
+THUMBNAIL_LOCAL_CACHE_MAX_BYTES = 2 * 1024 * 1024
+THUMBNAIL_LOCAL_CACHE_TIMEOUT = 5 * 60
+
+
+# Generated image garbage collection
+# `python manage.py gc_thumbnails` (run it from cron) deletes thumbnails and
+# renditions no trip uses once they are THUMBNAIL_GC_MIN_AGE seconds old, and
+# evicts the least recently used thumbnails while media/cache is larger than
+# THUMBNAIL_CACHE_MAX_BYTES (None: no cap).
+
+THUMBNAIL_CACHE_MAX_BYTES = None
+THUMBNAIL_GC_MIN_AGE = 60 * 60
+
+
+# Catalog caching
+# Anonymous catalog pages are cached for CATALOG_PAGE_CACHE_TIMEOUT seconds and
+# trip cards for CATALOG_FRAGMENT_CACHE_TIMEOUT; both are dropped as soon as what
+# they show changes.
+
+CATALOG_CACHE = 'catalog'
+CATALOG_PAGE_CACHE = True
+CATALOG_PAGE_CACHE_TIMEOUT = 5 * 60
+CATALOG_FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+
+# Performance instrumentation
+# website.instrumentation.PerformanceMiddleware records wall time, SQL queries,
+# SQL time, template time and response size for every request, by URL name.
+# Prometheus scrapes them from /metrics, which answers logged-in staff and
+# requests sending "Authorization: Bearer <METRICS_TOKEN>" only (set the token in
+# the METRICS_TOKEN environment variable and as the scrape job's bearer_token;
+# left empty, only staff can read the metrics). A view that runs more than its
+# QUERY_BUDGETS entry (or QUERY_BUDGET) queries in one request logs a warning.
+
+PERFORMANCE_METRICS = True
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+QUERY_BUDGET = 15
+QUERY_BUDGETS = {
+    'website:index': 8,
+    'website:list_trips': 8,
+    'website:trip_types': 8,
+    'website:cart': 8,
+    # Reserves seats trip by trip, so it grows with the size of the batch.
+    'website:bulk_update_cart': 30,
+    # Locks, takes stock, releases holds, freezes prices and adds to the sales rollups.
+    'website:order_confirmation': 25,
+}
+
+# Sales rollups
+# Daily revenue, seats and orders per trip, trip type and seller, updated as
+# orders are placed (see website/sales.py). Rebuild them from the orders with
+# `python manage.py rebuild_sales_rollups`. The staff dashboard at /sales
+# offers the SALES_DASHBOARD_DAYS ranges, in days.
+
+SALES_DASHBOARD_DAYS = (7, 30, 90, 365)
+SALES_DASHBOARD_DEFAULT_DAYS = 30
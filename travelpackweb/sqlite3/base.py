@@ -0,0 +1,53 @@
+"""
+SQLite backend tuned for concurrent requests.
+
+Django's SQLite backend with the pragmas in SQLITE_PRAGMAS run on every new
+connection. The defaults in settings switch the database to write-ahead
+logging, so pages keep reading while a checkout writes, and make writers wait
+busy_timeout milliseconds for each other instead of failing at once.
+
+With SQLITE_IMMEDIATE_TRANSACTIONS, atomic blocks start with BEGIN IMMEDIATE
+instead of BEGIN. A plain BEGIN only asks for the write lock at the first
+write; if another connection committed since the transaction's first read,
+SQLite cannot wait for the lock and fails straight away with "database is
+locked", busy timeout or not. Taking the lock up front makes concurrent
+checkouts queue up instead.
+"""
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+def pragma_statements(pragmas):
+    """
+    Purpose: Turn a {pragma: value} mapping into PRAGMA statements
+    Args: pragmas -- (dict) e.g. {'journal_mode': 'WAL', 'busy_timeout': 5000}
+    Returns: (list) the statements, in a stable order
+    Raises: ValueError when a pragma name or value is not a plain word or number
+    """
+    statements = []
+    for name, value in sorted(pragmas.items()):
+        value = str(value)
+        # PRAGMA values cannot be bound as query parameters.
+        if not name.replace('_', '').isalnum() or not value.lstrip('-').replace('_', '').isalnum():
+            raise ValueError('Invalid SQLite pragma: {} = {}'.format(name, value))
+        statements.append('PRAGMA {} = {}'.format(name, value))
+    return statements
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    purpose: Django's SQLite connection, tuned by SQLITE_PRAGMAS and SQLITE_IMMEDIATE_TRANSACTIONS
+    args: the same as django.db.backends.sqlite3's DatabaseWrapper
+    returns: (None): N/A
+    """
+
+    def init_connection_state(self):
+        super(DatabaseWrapper, self).init_connection_state()
+        for statement in pragma_statements(getattr(settings, 'SQLITE_PRAGMAS', None) or {}):
+            self.connection.execute(statement)
+
+    def _start_transaction_under_autocommit(self):
+        if getattr(settings, 'SQLITE_IMMEDIATE_TRANSACTIONS', False):
+            self.cursor().execute('BEGIN IMMEDIATE')
+        else:
+            super(DatabaseWrapper, self)._start_transaction_under_autocommit()
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class WebsiteConfig(AppConfig):
     name = 'website'
+
+    def ready(self):
+        # Connects the model signal receivers.
+        from website import signals
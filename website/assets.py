@@ -0,0 +1,370 @@
+"""
+Fingerprinted, precompressed static and media files.
+
+`python manage.py build_assets` runs collectstatic and then, for STATIC_ROOT
+and MEDIA_ROOT, hashes every file, writes gzip (and, when the brotli package
+is installed, brotli) copies of the compressible ones and records all of it
+in an assets.json manifest at the top of each root.
+
+The storages below turn a name into a fingerprinted URL when the manifest
+knows it -- main.css becomes main.0123456789ab.css -- and serve() answers
+those URLs with far-future immutable caching, since a fingerprinted URL's
+content never changes. Every response carries an ETag (a different one per
+encoding), honours If-None-Match and single byte Range requests, picks the
+precompressed copy the client accepts and is a FileResponse, so a WSGI server
+with wsgi.file_wrapper (gunicorn, uWSGI) sends the file with sendfile(). Files
+the manifest does not know yet, such as fresh uploads, keep their plain URL
+and are revalidated on every use.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import StaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST_NAME = 'assets.json'
+
+HASH_LENGTH = 12
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.json', '.svg', '.txt', '.html', '.xml', '.map', '.ico')
+
+# Encodings in order of preference: (Accept-Encoding token, file suffix).
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+_HASHED_NAME = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{%d})(?P<ext>\.[^./]*)?$' % HASH_LENGTH)
+
+_RANGE = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def hashed_name(name, digest):
+    """
+    Purpose: Insert a content hash into a file name
+    Args: name -- (str) e.g. 'css/main.css', digest -- (str) the file's hash
+    Returns: (str) e.g. 'css/main.0123456789ab.css'
+    """
+    stem, ext = os.path.splitext(name)
+    return '{}.{}{}'.format(stem, digest[:HASH_LENGTH], ext)
+
+
+def split_hashed_name(name):
+    """
+    Purpose: Take the content hash back out of a fingerprinted file name
+    Args: name -- (str) e.g. 'css/main.0123456789ab.css'
+    Returns: (tuple) ('css/main.css', '0123456789ab'), or (name, None) when name carries no hash
+    """
+    match = _HASHED_NAME.match(name)
+    if match is None:
+        return name, None
+    return match.group('stem') + (match.group('ext') or ''), match.group('hash')
+
+
+def file_digest(path):
+    """
+    Purpose: Hash a file's content without reading it into memory at once
+    Args: path -- (str) absolute path of the file
+    Returns: (str) hex SHA-256 of the content
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(64 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _precompress(path):
+    encodings = []
+    with open(path, 'rb') as source:
+        data = source.read()
+    variants = [('gzip', '.gz', lambda raw: gzip.compress(raw, compresslevel=9))]
+    if brotli is not None:
+        variants.insert(0, ('br', '.br', lambda raw: brotli.compress(raw, quality=11)))
+    for encoding, suffix, compress in variants:
+        compressed = compress(data)
+        # Only keep copies that are worth the extra lookup.
+        if len(compressed) < len(data) * 0.9:
+            with open(path + suffix, 'wb') as target:
+                target.write(compressed)
+            encodings.append(encoding)
+        elif os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return encodings
+
+
+def build_manifest(root, previous=None):
+    """
+    Purpose: Fingerprint and precompress every file under a directory and write its manifest
+    Args: root -- (str) absolute directory, e.g. STATIC_ROOT
+        previous -- (dict) an earlier manifest; files whose size and mtime are unchanged are not re-hashed
+    Returns: (dict) the manifest: {'files': {name: {'hash', 'size', 'mtime', 'encodings'}}}
+    """
+    if previous is None:
+        previous = read_manifest(root)
+    files = {}
+    for directory, subdirectories, names in os.walk(root):
+        subdirectories.sort()
+        for filename in sorted(names):
+            path = os.path.join(directory, filename)
+            name = os.path.relpath(path, root).replace(os.sep, '/')
+            if name == MANIFEST_NAME or filename.endswith(tuple(suffix for _, suffix in ENCODINGS)):
+                continue
+            stat = os.stat(path)
+            entry = previous.get('files', {}).get(name)
+            if entry is None or entry['size'] != stat.st_size or entry['mtime'] != int(stat.st_mtime):
+                encodings = []
+                if filename.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+                    encodings = _precompress(path)
+                entry = {
+                    'hash': file_digest(path)[:HASH_LENGTH],
+                    'size': stat.st_size,
+                    'mtime': int(stat.st_mtime),
+                    'encodings': encodings,
+                }
+            files[name] = entry
+
+    manifest = {'version': 1, 'files': files}
+    temporary = os.path.join(root, MANIFEST_NAME + '.tmp')
+    with open(temporary, 'w') as target:
+        json.dump(manifest, target, sort_keys=True)
+    # Readers never see a half-written manifest.
+    os.replace(temporary, os.path.join(root, MANIFEST_NAME))
+    with _manifests_lock:
+        _manifests[root] = (time.monotonic(), os.stat(os.path.join(root, MANIFEST_NAME)).st_mtime, manifest)
+    return manifest
+
+
+def read_manifest(root):
+    """
+    Purpose: Load a directory's manifest, re-reading it at most once a second when it changes
+    Args: root -- (str) absolute directory holding assets.json
+    Returns: (dict) the manifest, or an empty one when the directory has not been built
+    """
+    now = time.monotonic()
+    with _manifests_lock:
+        checked, mtime, manifest = _manifests.get(root, (0, None, None))
+        if manifest is not None and now - checked < 1:
+            return manifest
+    try:
+        current_mtime = os.stat(os.path.join(root, MANIFEST_NAME)).st_mtime
+    except OSError:
+        current_mtime = None
+    if manifest is None or current_mtime != mtime:
+        manifest = {'files': {}}
+        if current_mtime is not None:
+            with open(os.path.join(root, MANIFEST_NAME)) as source:
+                manifest = json.load(source)
+    with _manifests_lock:
+        _manifests[root] = (now, current_mtime, manifest)
+    return manifest
+
+
+class FingerprintedStorageMixin(object):
+    """
+    purpose: Give files the build step has fingerprinted a content-hashed URL
+    args: None
+    returns: (None): N/A
+    """
+
+    def fingerprint_urls(self):
+        return True
+
+    def url(self, name):
+        entry = read_manifest(self.location).get('files', {}).get(name) if self.fingerprint_urls() else None
+        if entry is not None:
+            name = hashed_name(name, entry['hash'])
+        return super(FingerprintedStorageMixin, self).url(name)
+
+
+class FingerprintedStaticStorage(FingerprintedStorageMixin, StaticFilesStorage):
+    """
+    purpose: STATICFILES_STORAGE giving collected, fingerprinted static files their hashed URL
+    args: None
+    returns: (None): N/A
+    """
+
+    def fingerprint_urls(self):
+        # runserver serves static files straight from the apps, which only know plain names.
+        return not settings.DEBUG
+
+
+class FingerprintedMediaStorage(FingerprintedStorageMixin, FileSystemStorage):
+    """
+    purpose: DEFAULT_FILE_STORAGE giving fingerprinted media files (uploads, renditions, thumbnails) their hashed URL
+    args: None
+    returns: (None): N/A
+    """
+
+
+def _accepted_encodings(request):
+    header = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    accepted = set()
+    for part in header.split(','):
+        token, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(token.strip().lower())
+    return accepted
+
+
+def _byte_range(header, size):
+    # Only a single range is supported; anything else is answered with the whole file.
+    match = _RANGE.match(header.strip())
+    if match is None:
+        return None
+    start, end = match.group('start'), match.group('end')
+    if not start and not end:
+        return None
+    if not start:
+        length = int(end)
+        return (max(size - length, 0), size - 1) if length else False
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+class _FileRange(object):
+    """
+    purpose: A read-only view of part of an open file, for ranged FileResponses
+    args: source -- the open file, start -- (integer) first byte, length -- (integer) number of bytes
+    returns: (None): N/A
+    """
+
+    def __init__(self, source, start, length):
+        source.seek(start)
+        self.source = source
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.source.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.source.close()
+
+
+@require_safe
+def serve(request, path, root_setting):
+    """
+    Purpose: Serve a static or media file, fingerprinted or not, as cheaply and cacheably as possible
+    Args: path -- (str) the requested name below the root, possibly with a content hash in it
+        root_setting -- (str) name of the setting holding the root directory, e.g. 'MEDIA_ROOT'
+    Returns: (FileResponse) the file (200/206), HttpResponseNotModified (304),
+        HttpResponse with status 416 for an unsatisfiable range
+    Raises: Http404 when there is no such file
+    """
+    root = getattr(settings, root_setting)
+    manifest = read_manifest(root).get('files', {})
+
+    name, digest = split_hashed_name(path)
+    if digest is None or path in manifest or name not in manifest:
+        # Not a fingerprinted name: serve the path as it is.
+        name, digest = path, None
+    # An old fingerprint (from a page cached before the last build) gets the current file, uncached.
+    entry = manifest.get(name)
+
+    try:
+        full_path = safe_join(root, name)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404('"{}" does not exist'.format(path))
+    if not os.path.isfile(full_path) or name == MANIFEST_NAME:
+        raise Http404('"{}" does not exist'.format(path))
+
+    # A file replaced since the last build is no longer what its hash describes.
+    if entry is not None and (entry['size'] != stat.st_size or entry['mtime'] != int(stat.st_mtime)):
+        entry = None
+    immutable = entry is not None and digest == entry['hash']
+
+    if entry is not None:
+        version = entry['hash']
+    else:
+        version = '{:x}-{:x}'.format(stat.st_size, int(stat.st_mtime))
+
+    content_type, original_encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    # Ranges are always cut from the file as it is, so If-Range is checked against its ETag.
+    range_header = request.META.get('HTTP_RANGE')
+    if range_header and request.META.get('HTTP_IF_RANGE', quote_etag(version)) != quote_etag(version):
+        range_header = None
+
+    encoding = None
+    if entry is not None and not range_header and original_encoding is None:
+        accepted = _accepted_encodings(request)
+        for token, suffix in ENCODINGS:
+            if token in entry['encodings'] and token in accepted and os.path.exists(full_path + suffix):
+                encoding, full_path = token, full_path + suffix
+                break
+
+    # Each encoding is different bytes, so it gets its own strong ETag: a cache holding the
+    # gzip copy must not have it confirmed as fresh by a client that only takes identity.
+    etag = quote_etag('{}-{}'.format(version, encoding) if encoding else version)
+
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': (
+            'public, max-age={}, immutable'.format(settings.ASSETS_IMMUTABLE_MAX_AGE) if immutable
+            else 'public, no-cache'
+        ),
+        'Vary': 'Accept-Encoding',
+        'Accept-Ranges': 'bytes',
+    }
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]):
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    if range_header:
+        byte_range = _byte_range(range_header, stat.st_size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(stat.st_size)
+            return response
+        if byte_range is not None:
+            start, end = byte_range
+            response = FileResponse(_FileRange(open(full_path, 'rb'), start, end - start + 1),
+                                    status=206, content_type=content_type)
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, stat.st_size)
+            response['Content-Length'] = end - start + 1
+            for header, value in headers.items():
+                response[header] = value
+            return response
+
+    # A plain open file lets the WSGI server use wsgi.file_wrapper / sendfile().
+    response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    response['Content-Length'] = os.path.getsize(full_path) if encoding else stat.st_size
+    if encoding:
+        response['Content-Encoding'] = encoding
+    elif original_encoding:
+        response['Content-Encoding'] = original_encoding
+    for header, value in headers.items():
+        response[header] = value
+    return response
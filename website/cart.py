@@ -0,0 +1,202 @@
+"""
+Cart and order summaries, and cart changes.
+
+An order holds one TripOrder line per trip, with a quantity. A summary is the
+order's line items with their trips loaded in the same query, plus the order
+total. Open carts are totalled by the database with a
+single SUM; placed orders use the total frozen on the order at checkout, so
+order history never recomputes it.
+"""
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, IntegerField, Sum, Value, When
+
+from website import inventory
+from website.models import Order, Trip, TripOrder
+
+
+class OrderSummary(object):
+    """
+    purpose: The line items and total of an order or cart
+    args: order -- the Order, items -- (list) its TripOrder rows, total -- (Decimal) what it costs
+    returns: (None): N/A
+    """
+
+    def __init__(self, order, items, total):
+        self.order = order
+        self.items = items
+        self.total = total
+
+
+def order_total(order):
+    """
+    Purpose: Add up the prices of every trip on an order in the database
+    Args: order -- the Order to total
+    Returns: (Decimal) the total, 0 for an empty order
+    """
+    line_total = ExpressionWrapper(
+        F('trip__price') * F('quantity'), output_field=DecimalField(max_digits=10, decimal_places=2))
+    total = TripOrder.objects.filter(order=order).aggregate(total=Sum(line_total))['total']
+    return total if total is not None else Decimal('0.00')
+
+
+def summarize_order(order):
+    """
+    Purpose: Load an order's line items and total in at most two queries
+    Args: order -- the Order (open or placed) to summarize
+    Returns: (OrderSummary) the order's line items and total
+    """
+    items = list(TripOrder.objects.filter(order=order).select_related('trip'))
+    total = order.total if order.total is not None else order_total(order)
+    return OrderSummary(order, items, total)
+
+
+class InvalidCartChange(ValueError):
+    pass
+
+
+# Most seats one change may add or remove, and the ids a trip can have (a signed 64-bit column).
+MAX_CHANGE_QUANTITY = 1000
+MAX_TRIP_ID = 2 ** 63 - 1
+
+
+def get_active_order(customer):
+    """
+    Purpose: Find the customer's open order (their cart), creating it if they have none
+    Args: customer -- the User whose cart to find
+    Returns: (Order) the open order
+    """
+    try:
+        return Order.objects.get(customer=customer, active=1)
+    except ObjectDoesNotExist:
+        pass
+    try:
+        with transaction.atomic():
+            return Order.objects.create(customer=customer, order_date=None, payment_type=None, active=1)
+    except IntegrityError:
+        # A concurrent request created the cart first; order_open_cart_idx allows only one.
+        return Order.objects.get(customer=customer, active=1)
+
+
+def parse_cart_changes(changes):
+    """
+    Purpose: Validate a batch of cart changes and merge changes to the same trip
+    Args: changes -- (list) of {"trip_id": integer, "qty": integer} dicts; a negative qty removes seats
+    Returns: (OrderedDict) trip id -> net quantity change, zero changes dropped
+    Raises: InvalidCartChange when the batch is not a list of such dicts, or an id or qty is out of range
+    """
+    if not isinstance(changes, list):
+        raise InvalidCartChange('Expected a list of {"trip_id": ..., "qty": ...} objects')
+    deltas = OrderedDict()
+    for change in changes:
+        try:
+            trip_id, quantity = change['trip_id'], change['qty']
+        except (TypeError, KeyError):
+            raise InvalidCartChange('Every change needs a trip_id and a qty')
+        # JSON true and false arrive as bools, which are ints to Python.
+        if not all(isinstance(value, int) and not isinstance(value, bool) for value in (trip_id, quantity)):
+            raise InvalidCartChange('trip_id and qty must be integers')
+        # Out-of-range numbers would make the database driver raise OverflowError.
+        if not 1 <= trip_id <= MAX_TRIP_ID:
+            raise InvalidCartChange('trip_id is not a trip')
+        if abs(quantity) > MAX_CHANGE_QUANTITY:
+            raise InvalidCartChange('qty must be between -{0} and {0}'.format(MAX_CHANGE_QUANTITY))
+        deltas[trip_id] = deltas.get(trip_id, 0) + quantity
+    return OrderedDict((trip_id, quantity) for trip_id, quantity in deltas.items() if quantity)
+
+
+def add_to_cart(order, trip, quantity=1):
+    """
+    Purpose: Put seats of a trip in an open order, raising the quantity of its line if it has one
+    Args: order -- the open Order, trip -- the Trip to add, quantity -- (integer) how many seats
+    Returns: (None): N/A
+    Raises: inventory.SoldOut when fewer than quantity seats are free; nothing is changed
+    """
+    with transaction.atomic():
+        inventory.reserve(trip, order, quantity)
+        lines = TripOrder.objects.filter(order=order, trip=trip)
+        if lines.update(quantity=F('quantity') + quantity):
+            return
+        try:
+            with transaction.atomic():
+                TripOrder.objects.create(order=order, trip=trip, quantity=quantity)
+        except IntegrityError:
+            # A concurrent request for the same cart added the line first.
+            lines.update(quantity=F('quantity') + quantity)
+
+
+def remove_line(order, line_id):
+    """
+    Purpose: Take a line off an open order and give back the seats it held
+    Args: order -- the open Order, line_id -- (integer) id of the TripOrder line to remove
+    Returns: (None): N/A
+    """
+    with transaction.atomic():
+        line = TripOrder.objects.filter(order=order, pk=line_id).first()
+        if line is None:
+            return
+        line.delete()
+        inventory.release(line.trip_id, order, line.quantity)
+
+
+def apply_cart_changes(order, deltas):
+    """
+    Purpose: Add and remove many trips on an open order in one transaction
+    Args: order -- the open Order to change
+        deltas -- (dict) trip id -> quantity change, as returned by parse_cart_changes
+    Returns: (None): N/A
+    Raises: InvalidCartChange for unknown trips; inventory.SoldOut when a trip has too few free seats.
+        Either way nothing is changed.
+    """
+    with transaction.atomic():
+        additions = [trip_id for trip_id, quantity in deltas.items() if quantity > 0]
+        trips = Trip.objects.in_bulk(additions)
+        unknown = set(additions) - set(trips)
+        if unknown:
+            raise InvalidCartChange('Unknown trips: {}'.format(sorted(unknown)))
+
+        current = dict(TripOrder.objects.select_for_update().filter(order=order, trip_id__in=list(deltas))
+                       .values_list('trip_id', 'quantity'))
+        emptied, changed, created = [], {}, []
+        for trip_id, delta in deltas.items():
+            held = current.get(trip_id, 0)
+            quantity = held + delta
+            if delta > 0:
+                inventory.reserve(trips[trip_id], order, delta)
+            elif held:
+                inventory.release(trip_id, order, min(held, -delta))
+
+            if held and quantity <= 0:
+                emptied.append(trip_id)
+            elif held:
+                changed[trip_id] = quantity
+            elif quantity > 0:
+                created.append(TripOrder(order=order, trip_id=trip_id, quantity=quantity))
+
+        if emptied:
+            TripOrder.objects.filter(order=order, trip_id__in=emptied).delete()
+        if changed:
+            TripOrder.objects.filter(order=order, trip_id__in=list(changed)).update(quantity=Case(
+                *[When(trip_id=trip_id, then=Value(quantity)) for trip_id, quantity in changed.items()],
+                output_field=IntegerField()
+            ))
+        TripOrder.objects.bulk_create(created)
+
+
+def cart_state(order):
+    """
+    Purpose: Describe an order's contents as plain data, one entry per trip
+    Args: order -- the Order to describe
+    Returns: (dict) the order id, its lines with quantities and the order total
+    """
+    summary = summarize_order(order)
+    items = [{
+        'trip_id': item.trip_id,
+        'title': item.trip.title,
+        'price': str(item.trip.price),
+        'qty': item.quantity,
+    } for item in summary.items]
+    return {'order_id': order.id, 'items': items, 'total': str(summary.total)}
@@ -0,0 +1,86 @@
+"""
+The customer's cart, remembered in their session.
+
+Every page shows how many seats are in the cart (the navbar badge), so the
+session keeps the id of the customer's open order and its seat count under
+SESSION_KEY. Pages read the badge from there without a query; the session is
+loaded for the logged-in user anyway. The cart views refresh the entry whenever
+they change the cart, and checkout and cancelling drop it.
+
+The id is only a hint: cart views still check that the order is the
+customer's and still open (another browser may have checked it out), and fall
+back to cart.get_active_order when it is not. The badge of a second browser
+can lag behind until that browser next changes or views its cart.
+"""
+from django.db.models import Sum
+
+from website.cart import get_active_order
+from website.models import Order, TripOrder
+
+SESSION_KEY = 'cart'
+
+
+def count_seats(order):
+    """
+    Purpose: Count the seats booked on an order
+    Args: order -- the Order, or None
+    Returns: (integer) the sum of its line quantities
+    """
+    if order is None:
+        return 0
+    return TripOrder.objects.filter(order=order).aggregate(seats=Sum('quantity'))['seats'] or 0
+
+
+def remember_cart(request, order, count=None):
+    """
+    Purpose: Store the customer's open order and its seat count in their session
+    Args: request -- the HTTP request, order -- the open Order or None when there is none
+        count -- (integer) seats on the order; counted in the database when not given
+    Returns: (dict) the stored {'order_id', 'count'} entry
+    """
+    entry = {
+        'order_id': order.pk if order is not None else None,
+        'count': count if count is not None else count_seats(order),
+    }
+    # Only a changed entry makes the session write itself back.
+    if request.session.get(SESSION_KEY) != entry:
+        request.session[SESSION_KEY] = entry
+    return entry
+
+
+def forget_cart(request):
+    """
+    Purpose: Drop the remembered cart, after checkout or cancelling the order
+    Args: request -- the HTTP request
+    Returns: (None): N/A
+    """
+    request.session.pop(SESSION_KEY, None)
+
+
+def cart_badge(request):
+    """
+    Purpose: Tell how many seats are in the customer's cart, from the session when it knows
+    Args: request -- the HTTP request of a logged-in customer
+    Returns: (integer) seats in the cart
+    """
+    entry = request.session.get(SESSION_KEY)
+    if entry is None:
+        # First page of the session: look, but do not create a cart just to show an empty badge.
+        order = Order.objects.filter(customer=request.user, active=1).first()
+        entry = remember_cart(request, order)
+    return entry['count']
+
+
+def get_cart_order(request):
+    """
+    Purpose: Find the customer's open order, starting from the one remembered in the session
+    Args: request -- the HTTP request of a logged-in customer
+    Returns: (Order) the open order, created when the customer has none
+    """
+    entry = request.session.get(SESSION_KEY)
+    if entry is not None and entry['order_id'] is not None:
+        order = Order.objects.filter(pk=entry['order_id'], customer=request.user, active=1).first()
+        if order is not None:
+            return order
+    # The caller remembers the order once it has changed or counted it.
+    return get_active_order(request.user)
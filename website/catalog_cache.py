@@ -0,0 +1,188 @@
+"""
+Page and fragment caching for the public catalog.
+
+Anonymous visitors to the catalog pages (index, All Trips, trip categories
+and trip detail) all get the same HTML, so anonymous_page_cache stores each
+rendered page and serves it again without touching the database. The trip
+cards inside those pages are cached on their own by the {% trip_card_cache %}
+tag (website/templatetags/catalog_cache.py), so logged-in visitors and page
+cache misses still reuse them.
+
+Nothing is ever deleted from the cache. Every key carries the current version
+of the scopes it depends on:
+
+* 'catalog'     -- any list of trips or trip types
+* 'trip_types'  -- trip type names
+* 'trip:<id>'   -- everything shown about one trip
+
+and bump() moves a scope to a new version whenever its data changes, so old
+entries are simply never read again and age out. website/signals.py bumps
+scopes on post_save/post_delete of Trip, TripType and TripReview; code that
+changes trips with queryset updates (seat counts, renditions) calls
+touch_trips() itself.
+
+Entries go to the CATALOG_CACHE cache alias; see CACHES in settings for the
+backends it can use. Hit and miss counts are kept per page and fragment name
+in each process; read them with stats().
+"""
+import hashlib
+import threading
+import time
+from collections import defaultdict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+_counters = defaultdict(lambda: {'hits': 0, 'misses': 0})
+_counters_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Purpose: Get the cache the catalog pages and fragments are stored in
+    Args: None
+    Returns: the CATALOG_CACHE cache backend
+    """
+    return caches[settings.CATALOG_CACHE]
+
+
+def trip_scope(trip_id):
+    """
+    Purpose: Name the version scope of one trip
+    Args: trip_id -- (integer) id of the trip
+    Returns: (str) e.g. 'trip:12'
+    """
+    return 'trip:{}'.format(trip_id)
+
+
+def _version_key(scope):
+    return 'catalog:version:{}'.format(scope)
+
+
+def _new_version():
+    # Starting from the clock means a version that was evicted never comes back as an old number.
+    return int(time.time() * 1000)
+
+
+def versions(scopes):
+    """
+    Purpose: Read the current versions of several scopes in one cache round trip
+    Args: scopes -- (list) scope names
+    Returns: (dict) scope -> (integer) version
+    """
+    cache = get_cache()
+    keys = {_version_key(scope): scope for scope in scopes}
+    found = cache.get_many(list(keys))
+    result = {}
+    for key, scope in keys.items():
+        if key not in found:
+            cache.add(key, _new_version(), None)
+            found[key] = cache.get(key, _new_version())
+        result[scope] = found[key]
+    return result
+
+
+def bump(*scopes):
+    """
+    Purpose: Move scopes to a new version so every page and fragment keyed on them is rebuilt
+    Args: scopes -- (str) scope names, e.g. 'catalog', trip_scope(3)
+    Returns: (None): N/A
+    """
+    cache = get_cache()
+    for scope in scopes:
+        try:
+            cache.incr(_version_key(scope))
+        except ValueError:
+            cache.set(_version_key(scope), _new_version(), None)
+
+
+def touch_trips(trip_ids):
+    """
+    Purpose: Invalidate what is cached about trips that were changed without a model save
+    Args: trip_ids -- (list) ids of the changed trips
+    Returns: (None): N/A
+    """
+    bump(*[trip_scope(trip_id) for trip_id in trip_ids])
+
+
+def attach_versions(trips):
+    """
+    Purpose: Look up the versions of many trips at once for the {% trip_card_cache %} tag
+    Args: trips -- (list) Trips about to be rendered as cards
+    Returns: (list) the same trips, each with a catalog_version attribute
+    """
+    trips = list(trips)
+    current = versions([trip_scope(trip.pk) for trip in trips])
+    for trip in trips:
+        trip.catalog_version = current[trip_scope(trip.pk)]
+    return trips
+
+
+def record(name, hit):
+    """
+    Purpose: Count a cache lookup for the hit-ratio metrics
+    Args: name -- (str) e.g. 'page:index' or 'fragment:trip_card', hit -- (bool) whether it was a hit
+    Returns: (None): N/A
+    """
+    with _counters_lock:
+        _counters[name]['hits' if hit else 'misses'] += 1
+
+
+def stats():
+    """
+    Purpose: Report this process's catalog cache hit ratios
+    Args: None
+    Returns: (dict) name -> {'hits', 'misses', 'hit_ratio'}
+    """
+    with _counters_lock:
+        report = {}
+        for name, counts in _counters.items():
+            lookups = counts['hits'] + counts['misses']
+            report[name] = dict(counts, hit_ratio=float(counts['hits']) / lookups if lookups else 0.0)
+        return report
+
+
+def reset_stats():
+    with _counters_lock:
+        _counters.clear()
+
+
+def anonymous_page_cache(scopes):
+    """
+    Purpose: Decorate a view so its GET responses to anonymous visitors are cached per URL
+    Args: scopes -- (list) scopes the page depends on, or a callable taking the view's
+            URL kwargs and returning them
+    Returns: (function) the decorator
+    """
+    def decorator(view):
+        name = 'page:{}'.format(view.__name__)
+
+        @wraps(view)
+        def cached_view(request, *args, **kwargs):
+            # Visitors who just wrote something must see it, not a page cached from a lagging replica.
+            if (request.method not in ('GET', 'HEAD') or request.user.is_authenticated
+                    or getattr(request, 'pinned_to_primary', False) or not settings.CATALOG_PAGE_CACHE):
+                return view(request, *args, **kwargs)
+
+            page_scopes = scopes(**kwargs) if callable(scopes) else scopes
+            current = versions(page_scopes)
+            key = 'catalog:{}:{}:{}'.format(
+                name,
+                hashlib.sha1(request.get_full_path().encode('utf-8')).hexdigest(),
+                '.'.join(str(current[scope]) for scope in page_scopes),
+            )
+            cache = get_cache()
+            cached = cache.get(key)
+            record(name, cached is not None)
+            if cached is not None:
+                content, content_type = cached
+                return HttpResponse(content, content_type=content_type)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming and not response.cookies:
+                cache.set(key, (response.content, response['Content-Type']), settings.CATALOG_PAGE_CACHE_TIMEOUT)
+            return response
+        return cached_view
+    return decorator
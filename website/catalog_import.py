@@ -0,0 +1,413 @@
+"""
+Bulk import of supplier trip catalogs.
+
+The import_trips command streams a catalog file one record at a time (JSON
+Lines: one object per line, or CSV with a header row) and hands the records
+to TripImporter in chunks. Each chunk costs a fixed number of queries however
+large it is:
+
+* the trip types and sellers it names are resolved through in-memory lookups
+  that only query for names not seen in an earlier chunk (missing trip types
+  are created, unknown sellers are an error for that record);
+* the trips it names are looked up by external_id in one query; new ones are
+  inserted with bulk_create and changed ones written back with bulk_update,
+  so importing the same file twice changes nothing the second time.
+
+A record has the keys external_id, title, trip_type (its name), seller (a
+username), price, num_of_nights and quantity, and optionally location,
+description, last_dep_date (YYYY-MM-DD) and image. bulk_create and update
+skip the model signals, so the importer indexes the trips for search and
+bumps the catalog cache itself.
+
+image is a URL or a file path (relative paths are read from image_root). With
+fetch_images on, each new or changed image is fetched into storage and its
+renditions are made (see website/images.py) on a pool of worker threads while
+the import goes on.
+"""
+import csv
+import hashlib
+import itertools
+import json
+import os
+import posixpath
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import Case, Value, When
+from django.utils.dateparse import parse_date
+
+from website import catalog_cache, images, search
+from website.models import Trip, TripType
+
+FORMATS = ('jsonl', 'csv')
+
+REQUIRED_FIELDS = ('external_id', 'title', 'trip_type', 'seller', 'price', 'num_of_nights', 'quantity')
+
+# Trip fields an import writes; everything else (seats sold, ratings, ...) belongs to the site.
+IMPORTED_FIELDS = (
+    'title', 'trip_type_id', 'seller_id', 'price', 'num_of_nights', 'quantity', 'location', 'description',
+    'last_dep_date',
+)
+
+# The largest value num_of_nights and quantity (positive integer columns) hold on every backend.
+MAX_INTEGER = 2 ** 31 - 1
+
+IMAGE_DIRECTORY = 'imports'
+IMAGE_FETCH_TIMEOUT = 30
+
+
+class RecordError(ValueError):
+    """
+    purpose: A catalog record that cannot be imported; the import goes on without it
+    args: message -- (str) what is wrong with the record
+    returns: (None): N/A
+    """
+
+
+def guess_format(path):
+    """
+    Purpose: Tell a catalog file's format from its name
+    Args: path -- (str) the file name
+    Returns: (str) 'csv' for .csv files, otherwise 'jsonl'
+    """
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_records(stream, format_name):
+    """
+    Purpose: Read catalog records one at a time, without loading the whole file
+    Args: stream -- an open text file, format_name -- (str) 'jsonl' or 'csv'
+    Returns: (generator) (line number, record) pairs; record is a dict, or a RecordError
+        when the line cannot be parsed
+    """
+    if format_name == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Empty cells are missing values.
+            yield reader.line_num, {key: value for key, value in row.items() if key and value not in ('', None)}
+        return
+
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            yield number, RecordError('not valid JSON ({})'.format(error))
+            continue
+        if not isinstance(record, dict):
+            yield number, RecordError('not a JSON object')
+            continue
+        yield number, record
+
+
+def chunked(iterable, size):
+    """
+    Purpose: Split an iterable into lists of at most size items, lazily
+    Args: iterable -- anything iterable, size -- (integer) items per chunk
+    Returns: (generator) the chunks
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _integer(record, key):
+    try:
+        value = int(record[key])
+    except (TypeError, ValueError, OverflowError):
+        # OverflowError: JSON's bare Infinity.
+        raise RecordError('{} must be a whole number'.format(key))
+    if value < 0:
+        raise RecordError('{} must not be negative'.format(key))
+    if value > MAX_INTEGER:
+        raise RecordError('{} is out of range'.format(key))
+    return value
+
+
+def clean_record(record):
+    """
+    Purpose: Check a catalog record and turn it into Trip field values
+    Args: record -- (dict) as read by read_records
+    Returns: (dict) the values; trip_type and seller are still names, image a source or None
+    """
+    missing = [key for key in REQUIRED_FIELDS if record.get(key) in ('', None)]
+    if missing:
+        raise RecordError('missing {}'.format(', '.join(missing)))
+
+    external_id = str(record['external_id']).strip()
+    if len(external_id) > Trip._meta.get_field('external_id').max_length:
+        raise RecordError('external_id is too long')
+    try:
+        price = Decimal(str(record['price'])).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise RecordError('price must be a number')
+    # NaN quantizes without complaint but cannot be compared.
+    if not price.is_finite():
+        raise RecordError('price must be a number')
+    if price < 0 or price >= 10 ** 6:
+        raise RecordError('price is out of range')
+    last_dep_date = None
+    if record.get('last_dep_date'):
+        try:
+            last_dep_date = parse_date(str(record['last_dep_date']))
+        except ValueError:
+            pass
+        if last_dep_date is None:
+            raise RecordError('last_dep_date must be a date (YYYY-MM-DD)')
+
+    return {
+        'external_id': external_id,
+        'title': str(record['title'])[:Trip._meta.get_field('title').max_length],
+        'trip_type': str(record['trip_type']),
+        'seller': str(record['seller']),
+        'price': price,
+        'num_of_nights': _integer(record, 'num_of_nights'),
+        'quantity': _integer(record, 'quantity'),
+        'location': str(record.get('location') or ''),
+        'description': str(record.get('description') or ''),
+        'last_dep_date': last_dep_date,
+        'image': str(record['image']) if record.get('image') else None,
+    }
+
+
+def bulk_update(trips, fields):
+    """
+    Purpose: Write several fields of many trips back in one UPDATE per batch (Django 1.11 has no bulk_update)
+    Args: trips -- (list) saved Trips carrying their new values, fields -- (list) attribute names to write
+    Returns: (None): N/A
+    """
+    if not trips or not fields:
+        return
+    # Each field costs two parameters per trip (the WHEN and THEN values) plus the id in the WHERE.
+    batch_size = max(1, connection.ops.bulk_batch_size(['pk'] * (2 * len(fields) + 1), trips))
+    for batch in chunked(trips, batch_size):
+        values = {}
+        for field in fields:
+            output_field = Trip._meta.get_field(field)
+            values[field] = Case(
+                *[When(pk=trip.pk, then=Value(getattr(trip, field), output_field=output_field)) for trip in batch],
+                output_field=output_field)
+        Trip.objects.filter(pk__in=[trip.pk for trip in batch]).update(**values)
+
+
+def image_storage_name(source):
+    """
+    Purpose: Choose where an imported image is stored; the same source always lands in the same place
+    Args: source -- (str) the image URL or path from the catalog
+    Returns: (str) storage name under IMAGE_DIRECTORY
+    """
+    basename = posixpath.basename(urlparse(source).path) or 'image'
+    digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:10]
+    return '{}/{}-{}'.format(IMAGE_DIRECTORY, digest, basename)
+
+
+def fetch_image(source, image_root):
+    """
+    Purpose: Copy a catalog image into storage, unless an earlier import already did
+    Args: source -- (str) the image URL or path, image_root -- (str) directory relative paths start from
+    Returns: (str) the storage name of the image
+    """
+    name = image_storage_name(source)
+    if default_storage.exists(name):
+        return name
+    if urlparse(source).scheme in ('http', 'https', 'file'):
+        with urlopen(source, timeout=IMAGE_FETCH_TIMEOUT) as response:
+            data = response.read()
+    else:
+        with open(os.path.join(image_root, source), 'rb') as image_file:
+            data = image_file.read()
+    return default_storage.save(name, ContentFile(data))
+
+
+def import_image(trip_id, source, image_root):
+    """
+    Purpose: Fetch a trip's catalog image, make it the trip's image and cut its renditions
+    Args: trip_id -- (integer) id of the trip, source -- (str) the image URL or path,
+        image_root -- (str) directory relative paths start from
+    Returns: (str) the storage name of the image
+    """
+    name = fetch_image(source, image_root)
+    Trip.objects.filter(pk=trip_id).update(trip_img=name)
+    images.generate_for_trip(trip_id, name)
+    return name
+
+
+class TripImporter(object):
+    """
+    purpose: Import catalog records chunk by chunk; see the module docstring
+    args: fetch_images -- (bool) also fetch images and make their renditions
+        workers -- (integer) images processed in parallel; 1 processes them in line
+        image_root -- (str) directory relative image paths start from
+    returns: (None): N/A
+    """
+
+    def __init__(self, fetch_images=False, workers=1, image_root='.'):
+        self.fetch_images = fetch_images
+        self.workers = workers
+        self.image_root = image_root
+        self.trip_types = {}
+        self.sellers = {}
+        self.created = self.updated = self.unchanged = 0
+        self.errors = []
+        self.image_results = []
+        self.pool = ThreadPoolExecutor(max_workers=workers) if fetch_images and workers > 1 else None
+
+    def _resolve(self, names, lookup, model, field):
+        unknown = set(names) - set(lookup)
+        if unknown:
+            lookup.update(model.objects.filter(**{field + '__in': unknown}).values_list(field, 'pk'))
+        return set(names) - set(lookup)
+
+    def resolve_trip_types(self, names):
+        """
+        Purpose: Find the ids of trip types by name, creating the ones that do not exist yet
+        Args: names -- (iterable) trip type names
+        Returns: (None): N/A; the ids are in self.trip_types
+        """
+        missing = self._resolve(names, self.trip_types, TripType, 'trip_type_name')
+        if missing:
+            TripType.objects.bulk_create([TripType(trip_type_name=name) for name in sorted(missing)])
+            self._resolve(missing, self.trip_types, TripType, 'trip_type_name')
+            catalog_cache.bump('catalog', 'trip_types')
+
+    def resolve_sellers(self, usernames):
+        """
+        Purpose: Find the ids of sellers by username
+        Args: usernames -- (iterable) usernames
+        Returns: (set) the usernames that belong to no user
+        """
+        return self._resolve(usernames, self.sellers, User, 'username')
+
+    def import_chunk(self, records):
+        """
+        Purpose: Create or update the trips of one chunk of records
+        Args: records -- (list) (line number, record) pairs from read_records
+        Returns: (None): N/A; counts and errors are kept on the importer
+        """
+        cleaned = OrderedDict()
+        for number, record in records:
+            try:
+                if isinstance(record, RecordError):
+                    raise record
+                values = clean_record(record)
+            except RecordError as error:
+                self.errors.append((number, str(error)))
+                continue
+            # A trip listed twice in one chunk: the later record wins.
+            cleaned.pop(values['external_id'], None)
+            cleaned[values['external_id']] = (number, values)
+        if not cleaned:
+            return
+
+        self.resolve_trip_types({values['trip_type'] for number, values in cleaned.values()})
+        unknown_sellers = self.resolve_sellers({values['seller'] for number, values in cleaned.values()})
+        for external_id, (number, values) in list(cleaned.items()):
+            if values['seller'] in unknown_sellers:
+                self.errors.append((number, 'no user named {}'.format(values['seller'])))
+                del cleaned[external_id]
+            else:
+                values['trip_type_id'] = self.trip_types[values.pop('trip_type')]
+                values['seller_id'] = self.sellers[values.pop('seller')]
+
+        with transaction.atomic():
+            existing = {trip.external_id: trip for trip in Trip.objects.filter(external_id__in=list(cleaned))}
+            new_trips, changed_trips, changed_fields = [], [], set()
+            for external_id, (number, values) in cleaned.items():
+                trip = existing.get(external_id)
+                if trip is None:
+                    new_trips.append(Trip(external_id=external_id, **{field: values[field] for field in IMPORTED_FIELDS}))
+                    continue
+                changed = [field for field in IMPORTED_FIELDS if getattr(trip, field) != values[field]]
+                for field in changed:
+                    setattr(trip, field, values[field])
+                if changed:
+                    changed_trips.append(trip)
+                    changed_fields.update(changed)
+
+            Trip.objects.bulk_create(new_trips)
+            bulk_update(changed_trips, sorted(changed_fields))
+
+            # bulk_create does not return ids on every backend; read the saved trips back.
+            saved = list(Trip.objects.filter(
+                external_id__in=[trip.external_id for trip in new_trips + changed_trips]).order_by('pk'))
+            search.index_trips(saved)
+
+        self.created += len(new_trips)
+        self.updated += len(changed_trips)
+        self.unchanged += len(cleaned) - len(new_trips) - len(changed_trips)
+        if saved:
+            catalog_cache.bump('catalog', *[catalog_cache.trip_scope(trip.pk) for trip in saved])
+
+        if self.fetch_images:
+            trips = {trip.external_id: trip for trip in saved}
+            trips.update((trip.external_id, trip) for trip in existing.values() if trip.external_id not in trips)
+            for external_id, (number, values) in cleaned.items():
+                trip = trips[external_id]
+                if values['image'] is None:
+                    continue
+                if trip.trip_img.name == image_storage_name(values['image']) and not images.needs_renditions(trip):
+                    continue
+                self.schedule_image(number, trip.pk, values['image'])
+
+    def schedule_image(self, number, trip_id, source):
+        """
+        Purpose: Import one trip's image, on the worker pool when there is one
+        Args: number -- (integer) the record's line, trip_id -- (integer) id of the trip,
+            source -- (str) the image URL or path
+        Returns: (None): N/A
+        """
+        if self.pool is None:
+            self.image_results.append((number, source, self._run_image(trip_id, source)))
+        else:
+            self.image_results.append((number, source, self.pool.submit(self._run_image_in_worker, trip_id, source)))
+
+    def _run_image(self, trip_id, source):
+        try:
+            import_image(trip_id, source, self.image_root)
+        except Exception as error:
+            return error
+        return None
+
+    def _run_image_in_worker(self, trip_id, source):
+        try:
+            return self._run_image(trip_id, source)
+        finally:
+            # Each worker thread has its own database connection.
+            connection.close()
+
+    def run(self, records, chunk_size=500):
+        """
+        Purpose: Import every record, chunk_size records at a time, and wait for the images
+        Args: records -- (iterable) (line number, record) pairs from read_records
+            chunk_size -- (integer) records per chunk
+        Returns: (dict) created, updated, unchanged, failed and images counts
+        """
+        try:
+            for chunk in chunked(records, chunk_size):
+                self.import_chunk(chunk)
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown(wait=True)
+
+        image_errors = 0
+        for number, source, result in self.image_results:
+            error = result.result() if self.pool is not None else result
+            if error is not None:
+                image_errors += 1
+                self.errors.append((number, 'image {}: {}'.format(source, error)))
+        return {
+            'created': self.created, 'updated': self.updated, 'unchanged': self.unchanged,
+            'failed': len(self.errors) - image_errors,
+            'images': len(self.image_results) - image_errors, 'image_errors': image_errors,
+        }
@@ -0,0 +1,98 @@
+"""
+Order confirmation.
+
+Confirming an order takes stock for every trip on it, freezes its line prices
+and total and closes the order in one transaction. Stock is taken with a
+single guarded UPDATE, so two customers checking out at the same moment can
+never both buy the last seat: one of them gets SoldOut and nothing of their
+order is written. Seats the order holds (see website/inventory.py) count as its
+own; seats held by other carts do not, and holds that have expired are swept
+first. The same transaction adds the order to the daily sales rollups
+(website/sales.py).
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Value, When
+from django.utils import timezone
+
+from website import inventory, sales
+from website.cart import order_total
+from website.catalog_cache import touch_trips
+from website.inventory import SoldOut
+from website.models import Order, PaymentType, Trip, TripOrder, TripReservation
+
+
+class _NotEnoughStock(Exception):
+    pass
+
+
+def _per_trip(quantities):
+    return Case(
+        *[When(pk=trip_id, then=Value(quantity)) for trip_id, quantity in quantities.items()],
+        default=Value(0),
+        output_field=IntegerField()
+    )
+
+
+def confirm_order(order_id, customer, payment_type_id):
+    """
+    Purpose: Take stock for every trip on an order and mark the order as placed, all or nothing
+    Args: order_id -- (integer) id of the customer's active order
+        customer -- the User placing the order
+        payment_type_id -- (integer) id of one of the customer's payment types
+    Returns: (Order) the completed order
+    Raises: SoldOut when any trip on the order does not have enough stock left;
+        Order.DoesNotExist / PaymentType.DoesNotExist when the ids do not belong to the customer
+    """
+    try:
+        with transaction.atomic():
+            # Locks the order so the same cart cannot be confirmed twice at once.
+            order = Order.objects.select_for_update().get(pk=order_id, customer=customer, active=True)
+            payment_type = PaymentType.objects.get(pk=payment_type_id, customer=customer)
+
+            trip_quantities = dict(TripOrder.objects.filter(order=order).values_list('trip', 'quantity'))
+
+            if trip_quantities:
+                # Row locks where the backend has them (SQLite locks the whole database on
+                # write instead); taken in id order so concurrent checkouts cannot deadlock.
+                list(Trip.objects.select_for_update().filter(pk__in=list(trip_quantities))
+                     .order_by('pk').values_list('pk', flat=True))
+                # Holds whose time is up still count in quantity_reserved until swept.
+                inventory.expire_holds(trip_ids=list(trip_quantities))
+
+                # Locked, so a sweep cannot delete them (and give their seats back) meanwhile.
+                holds = list(TripReservation.objects.select_for_update().filter(order=order)
+                             .values_list('pk', 'trip', 'quantity'))
+                held = {trip_id: quantity for pk, trip_id, quantity in holds}
+                needed = _per_trip(trip_quantities)
+                # Free seats plus the ones this order already holds must cover what it needs.
+                # The held seats are sold now, so they come off quantity_reserved in the same UPDATE.
+                updated = Trip.objects.filter(
+                    pk__in=list(trip_quantities),
+                    quantity__gte=F('quantity_reserved') - _per_trip(held) + needed,
+                ).update(
+                    quantity=F('quantity') - needed,
+                    quantity_sold=F('quantity_sold') + needed,
+                    quantity_reserved=F('quantity_reserved') - _per_trip(held),
+                )
+                if updated != len(trip_quantities):
+                    raise _NotEnoughStock(trip_quantities, held)
+                touch_trips(list(trip_quantities))
+                TripReservation.objects.filter(pk__in=[pk for pk, trip_id, quantity in holds]).delete()
+
+            # Freeze what each seat cost, for order exports and sales reports.
+            TripOrder.objects.filter(order=order).update(
+                unit_price=Subquery(Trip.objects.filter(pk=OuterRef('trip_id')).values('price')[:1]))
+            order.payment_type = payment_type
+            order.total = order_total(order)
+            order.active = False
+            order.order_date = timezone.now()
+            order.save()
+            sales.record_order(order)
+    except _NotEnoughStock as error:
+        trip_quantities, held = error.args
+        raise SoldOut(list(Trip.objects.filter(
+            pk__in=list(trip_quantities),
+            quantity__lt=F('quantity_reserved') - _per_trip(held) + _per_trip(trip_quantities),
+        )))
+
+    return order
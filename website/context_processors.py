@@ -0,0 +1,15 @@
+from django.utils.functional import SimpleLazyObject
+
+from website.cart_session import cart_badge
+
+
+def cart(request):
+    """
+    Purpose: Give every template the number of seats in the logged-in customer's cart
+    Args: request -- the HTTP request being rendered
+    Returns: (dict) cart_count, worked out only if a template uses it; empty for visitors
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'cart_count': SimpleLazyObject(lambda: cart_badge(request))}
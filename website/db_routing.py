@@ -0,0 +1,98 @@
+"""
+Read replica routing.
+
+PrimaryReplicaRouter sends every write to 'default' (the primary). Reads go
+to the primary too, except while ReplicaRoutingMiddleware is handling a
+request for one of the read-only catalog views in REPLICA_READ_VIEWS; those
+read from one of DATABASE_REPLICAS (see travelpackweb/database.py).
+
+Replicas lag behind the primary, so a visitor who has just changed something
+must not be sent to one. Any request that is not a GET/HEAD/OPTIONS reads
+and writes only the primary, and its response sets a short-lived cookie that
+keeps that visitor's following requests on the primary for
+REPLICA_PIN_SECONDS -- long enough for the replicas to catch up.
+"""
+import random
+import threading
+
+from django.conf import settings
+
+PIN_COOKIE = 'pin_primary'
+
+_state = threading.local()
+
+
+def reading_from_replica():
+    """
+    Purpose: Tell whether reads in the current thread may go to a replica
+    Args: None
+    Returns: (bool) True while serving a replica-safe request
+    """
+    return getattr(_state, 'use_replica', False)
+
+
+class use_replica(object):
+    """
+    purpose: Context manager sending the current thread's reads to a replica (when there is one)
+    args: enabled -- (bool) False keeps reads on the primary
+    returns: (None): N/A
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+
+    def __enter__(self):
+        self.previous = reading_from_replica()
+        _state.use_replica = self.enabled
+
+    def __exit__(self, *exc_info):
+        _state.use_replica = self.previous
+
+
+class PrimaryReplicaRouter(object):
+    """
+    purpose: DATABASE_ROUTERS entry: writes to the primary, reads to a replica when allowed
+    args: None
+    returns: (None): N/A
+    """
+
+    def db_for_read(self, model, **hints):
+        if settings.DATABASE_REPLICAS and reading_from_replica():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+
+class ReplicaRoutingMiddleware(object):
+    """
+    purpose: Decide per request whether its reads may come from a replica, and pin writers to the primary
+    args: get_response -- the next middleware or view
+    returns: (None): N/A
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.pinned_to_primary = (
+            request.method not in ('GET', 'HEAD', 'OPTIONS') or PIN_COOKIE in request.COOKIES
+        )
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.use_replica = False
+
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        view_name = match.view_name if match is not None else None
+        _state.use_replica = not request.pinned_to_primary and view_name in settings.REPLICA_READ_VIEWS
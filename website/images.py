@@ -0,0 +1,161 @@
+"""
+Pre-generated trip image renditions.
+
+When a trip's image is uploaded or replaced, a fixed set of renditions is
+cut from it (grid card, detail hero and 2x retina versions of both, each as
+JPEG and, when Pillow has WebP support, WebP). The work runs on a small
+thread pool once the upload has been committed, and the storage paths are
+written to Trip.trip_img_renditions. Listing pages then serve the card
+renditions directly and never resize or ship originals on request. The
+generate_trip_renditions management command backfills existing trips.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps, features
+
+from website import catalog_cache
+from website.models import Trip
+
+# name -> (width, height); every rendition is cropped to fill exactly this box.
+RENDITIONS = {
+    'card': (400, 300),
+    'card_2x': (800, 600),
+    'hero': (1150, 400),
+    'hero_2x': (2300, 800),
+}
+
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+
+_executor = None
+
+logger = logging.getLogger(__name__)
+
+
+def webp_supported():
+    """
+    Purpose: Check whether this Pillow build can write WebP
+    Args: None
+    Returns: (bool) True when WebP renditions can be made
+    """
+    return features.check('webp')
+
+
+def rendition_directory(image_name):
+    """
+    Purpose: Choose where the renditions of one source image are stored
+    Args: image_name -- (str) storage name of the original image
+    Returns: (str) a storage directory unique to that image name
+    """
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    digest = hashlib.sha1(image_name.encode('utf-8')).hexdigest()[:10]
+    return 'renditions/{}-{}'.format(stem, digest)
+
+
+def _encode(image, format_name):
+    buffer = io.BytesIO()
+    if format_name == 'JPEG':
+        image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def _save(path, data):
+    # Regenerating replaces the old file instead of saving next to it under a new name.
+    if default_storage.exists(path):
+        default_storage.delete(path)
+    return default_storage.save(path, ContentFile(data))
+
+
+def make_renditions(image_name):
+    """
+    Purpose: Cut every rendition from a stored original image and save them to storage
+    Args: image_name -- (str) storage name of the original image
+    Returns: (dict) rendition name -> storage path, plus 'source' -> image_name
+    """
+    with default_storage.open(image_name, 'rb') as original:
+        source = Image.open(original)
+        source.load()
+
+    if source.mode not in ('RGB', 'L'):
+        source = source.convert('RGBA')
+        background = Image.new('RGB', source.size, (255, 255, 255))
+        background.paste(source, mask=source.split()[-1])
+        source = background
+
+    directory = rendition_directory(image_name)
+    paths = {'source': image_name}
+    for name, size in RENDITIONS.items():
+        image = ImageOps.fit(source, size, Image.LANCZOS, centering=(0.5, 0.5))
+        paths[name] = _save('{}/{}.jpg'.format(directory, name), _encode(image, 'JPEG'))
+        if webp_supported():
+            paths[name + '_webp'] = _save('{}/{}.webp'.format(directory, name), _encode(image, 'WEBP'))
+    return paths
+
+
+def needs_renditions(trip):
+    """
+    Purpose: Check whether a trip's stored renditions are missing or were made from another image
+    Args: trip -- the Trip to check
+    Returns: (bool) True when renditions should be (re)generated
+    """
+    return bool(trip.trip_img) and trip.renditions.get('source') != trip.trip_img.name
+
+
+def generate_for_trip(trip_id, image_name):
+    """
+    Purpose: Make the renditions of a trip's image and record them on the trip
+    Args: trip_id -- (integer) id of the trip, image_name -- (str) the image they are made from
+    Returns: (dict) the recorded renditions
+    """
+    paths = make_renditions(image_name)
+    # Only record them if the trip still has this image; a newer upload has its own job.
+    if Trip.objects.filter(pk=trip_id, trip_img=image_name).update(trip_img_renditions=json.dumps(paths)):
+        # Cached cards and pages still point at the original image.
+        catalog_cache.bump('catalog', catalog_cache.trip_scope(trip_id))
+    return paths
+
+
+def _run_job(trip_id, image_name):
+    try:
+        generate_for_trip(trip_id, image_name)
+    except Exception:
+        logger.exception('Could not make renditions of %s for trip %s', image_name, trip_id)
+    finally:
+        # Worker threads get their own database connection; don't leave it open.
+        connection.close()
+
+
+def get_executor():
+    """
+    Purpose: Get the shared worker pool that rendition jobs run on
+    Args: None
+    Returns: (ThreadPoolExecutor) the pool, created on first use
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.TRIP_IMAGE_WORKERS)
+    return _executor
+
+
+def schedule_renditions(trip):
+    """
+    Purpose: Queue rendition generation for a trip once the current transaction commits
+    Args: trip -- the saved Trip whose image is new or changed
+    Returns: (None): N/A
+    """
+    trip_id, image_name = trip.pk, trip.trip_img.name
+    if not settings.TRIP_IMAGE_RENDITIONS_ASYNC:
+        transaction.on_commit(lambda: generate_for_trip(trip_id, image_name))
+        return
+    transaction.on_commit(lambda: get_executor().submit(_run_job, trip_id, image_name))
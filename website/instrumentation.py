@@ -0,0 +1,212 @@
+"""
+Per-request performance instrumentation.
+
+PerformanceMiddleware measures every request and records, per URL name (the
+view_name of website/urls.py, e.g. 'website:list_trips') and method:
+
+* wall time, from the first middleware in to the response out;
+* the number of SQL queries (not counting BEGIN, SAVEPOINT and the like) and
+  the time they took, on every database alias;
+* time spent rendering templates (through TimedDjangoTemplates, the template
+  backend in settings);
+* response size.
+
+The numbers go to the histograms in website/metrics.py, served at /metrics.
+A request that runs more queries than its view's budget (QUERY_BUDGETS, or
+QUERY_BUDGET for views not listed) logs a warning, which is how N+1 queries
+creeping back into a view show up.
+
+Queries are counted by count_queries, which wraps every cursor the database
+connections hand out during the request; it keeps a running count and time,
+not the SQL, and leaves Django's debug query log alone.
+
+Streamed responses (the trip list, files) are measured up to their headers
+only: rendering their bodies happens after the middleware has returned.
+"""
+import contextlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+from website import metrics
+
+logger = logging.getLogger(__name__)
+
+# Not counted as queries (their time is): atomic blocks add these around real work.
+TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE SAVEPOINT')
+
+_state = threading.local()
+
+
+class TimedTemplate(Template):
+    """
+    purpose: A Django template that adds its render time to the current request's total
+    args: the same as django.template.backends.django.Template
+    returns: (None): N/A
+    """
+
+    def render(self, context=None, request=None):
+        depth = getattr(_state, 'template_depth', None)
+        if depth is None:
+            # Not inside a measured request.
+            return super(TimedTemplate, self).render(context, request)
+
+        # Templates rendered while rendering another one are already inside its time.
+        _state.template_depth = depth + 1
+        started = time.perf_counter()
+        try:
+            return super(TimedTemplate, self).render(context, request)
+        finally:
+            _state.template_depth = depth
+            if depth == 0:
+                _state.template_seconds += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    purpose: The Django template backend, returning TimedTemplates
+    args: the same as django.template.backends.django.DjangoTemplates
+    returns: (None): N/A
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super(TimedDjangoTemplates, self).from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super(TimedDjangoTemplates, self).get_template(template_name).template, self)
+
+
+def query_budget(view_name):
+    """
+    Purpose: Look up how many SQL queries a view may run per request
+    Args: view_name -- (str) the view's URL name, e.g. 'website:cart'
+    Returns: (integer) the budget, or None for no budget
+    """
+    return settings.QUERY_BUDGETS.get(view_name, settings.QUERY_BUDGET)
+
+
+class QueryCounter(object):
+    """
+    purpose: Keep the number and total time of the SQL queries run while it is installed
+    args: None
+    returns: (None): N/A
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def record(self, sql, seconds):
+        if not sql.startswith(TRANSACTION_STATEMENTS):
+            self.queries += 1
+        self.seconds += seconds
+
+
+class CountingCursor(object):
+    """
+    purpose: A database cursor that reports each execute to a QueryCounter
+    args: cursor -- the cursor Django would have returned, counter -- the QueryCounter
+    returns: (None): N/A
+    """
+
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return self.cursor.__exit__(type, value, traceback)
+
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.counter.record(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, param_list):
+        started = time.perf_counter()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.counter.record(sql, time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def count_queries():
+    """
+    Purpose: Count the SQL queries run on every database alias inside a with block
+    Args: None
+    Returns: (QueryCounter) yielded to the block; read it after the block
+    """
+    counter = QueryCounter()
+    # Django 1.11 has no execute_wrapper; every cursor (chunked ones included) passes
+    # through _prepare_cursor, so the connection's is wrapped for the block's length.
+    patched = []
+    for db in connections.all():
+        # A count_queries block already around this one keeps counting too.
+        patched.append((db, vars(db).get('_prepare_cursor')))
+        prepare = db._prepare_cursor
+        db._prepare_cursor = lambda cursor, prepare=prepare: CountingCursor(prepare(cursor), counter)
+    try:
+        yield counter
+    finally:
+        for db, outer in patched:
+            if outer is None:
+                del db._prepare_cursor
+            else:
+                db._prepare_cursor = outer
+
+
+class PerformanceMiddleware(object):
+    """
+    purpose: Measure each request and record it in website.metrics; see the module docstring
+    args: get_response -- the next middleware or view
+    returns: (None): N/A
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.PERFORMANCE_METRICS:
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        _state.template_depth, _state.template_seconds = 0, 0.0
+        try:
+            with count_queries() as counter:
+                response = self.get_response(request)
+        finally:
+            template_seconds = _state.template_seconds
+            _state.template_depth = None
+        queries, sql_seconds = counter.queries, counter.seconds
+
+        match = request.resolver_match
+        view_name = match.view_name if match is not None else 'unresolved'
+        labels = (view_name, request.method)
+        metrics.REQUEST_DURATION.observe(time.perf_counter() - started, *labels)
+        metrics.REQUEST_QUERIES.observe(queries, *labels)
+        metrics.REQUEST_SQL_DURATION.observe(sql_seconds, *labels)
+        metrics.REQUEST_TEMPLATE_DURATION.observe(template_seconds, *labels)
+        if not response.streaming:
+            metrics.RESPONSE_SIZE.observe(len(response.content), *labels)
+
+        budget = query_budget(view_name)
+        if budget is not None and queries > budget:
+            metrics.QUERY_BUDGET_EXCEEDED.inc(view_name)
+            logger.warning('%s ran %d SQL queries, over its budget of %d (%s %s)',
+                           view_name, queries, budget, request.method, request.get_full_path())
+        return response
@@ -0,0 +1,149 @@
+"""
+Seat reservations for carts.
+
+Adding a trip to a cart places a time-limited hold (a TripReservation) on
+its seats. Every trip keeps a running quantity_reserved counter next to
+quantity, so the number of free seats is quantity - quantity_reserved and
+never needs a COUNT over reservations.
+
+Holds expire TRIP_RESERVATION_TTL seconds after they were last touched.
+Expired holds are removed lazily when a trip looks sold out, and in bulk by
+the sweep_reservations management command (run it from cron). Holds are
+deleted -- expired, removed from the cart, consumed at checkout or with their
+order (a pre_delete receiver in website/signals.py) -- through delete_holds
+only, which gives seats back for the rows its own DELETE removed. A sweep,
+lazy expiry and checkout can race for the same hold; only one of them wins the
+row, so its seats are never returned twice.
+"""
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from website.catalog_cache import touch_trips
+from website.models import Trip, TripReservation
+
+
+class SoldOut(Exception):
+    """
+    purpose: Raised when more seats of a trip are asked for than are free
+    args: trips -- (list) the trips that cannot be supplied
+    returns: (None): N/A
+    """
+
+    def __init__(self, trips):
+        super(SoldOut, self).__init__('Sold out: {}'.format(', '.join(str(trip) for trip in trips)))
+        self.trips = trips
+
+
+def hold_expiry():
+    """
+    Purpose: Work out when a hold placed or renewed now should lapse
+    Args: None
+    Returns: (datetime) now plus TRIP_RESERVATION_TTL seconds
+    """
+    return timezone.now() + datetime.timedelta(seconds=settings.TRIP_RESERVATION_TTL)
+
+
+def _take_seats(trip_id, quantity):
+    taken = Trip.objects.filter(
+        pk=trip_id, quantity__gte=F('quantity_reserved') + quantity,
+    ).update(quantity_reserved=F('quantity_reserved') + quantity)
+    if taken:
+        # The trip page shows the seats left.
+        touch_trips([trip_id])
+    return taken
+
+
+def reserve(trip, order, quantity=1):
+    """
+    Purpose: Hold seats on a trip for an open order, or extend the order's existing hold
+    Args: trip -- the Trip to hold seats on
+        order -- the open Order the seats are for
+        quantity -- (integer) how many more seats to hold
+    Returns: (TripReservation) the order's hold on the trip
+    Raises: SoldOut when fewer than quantity seats are free, even after expired holds are cleared
+    """
+    with transaction.atomic():
+        if not _take_seats(trip.pk, quantity):
+            # The trip looks full; stale holds may be all that is in the way.
+            expire_holds(trip_ids=[trip.pk])
+            if not _take_seats(trip.pk, quantity):
+                raise SoldOut([trip])
+
+        expires_at = hold_expiry()
+        holds = TripReservation.objects.filter(order=order, trip=trip)
+        if not holds.update(quantity=F('quantity') + quantity, expires_at=expires_at):
+            try:
+                with transaction.atomic():
+                    return TripReservation.objects.create(
+                        order=order, trip=trip, quantity=quantity, expires_at=expires_at)
+            except IntegrityError:
+                # A concurrent request for the same cart created the hold first.
+                holds.update(quantity=F('quantity') + quantity, expires_at=expires_at)
+        return holds.get()
+
+
+def release(trip_id, order, quantity=1):
+    """
+    Purpose: Give back some of the seats an order holds on a trip
+    Args: trip_id -- (integer) id of the trip
+        order -- the Order holding the seats
+        quantity -- (integer) how many seats to give back
+    Returns: (None): N/A
+    """
+    with transaction.atomic():
+        hold = TripReservation.objects.select_for_update().filter(order=order, trip_id=trip_id).first()
+        if hold is None:
+            return
+        if hold.quantity <= quantity:
+            delete_holds(TripReservation.objects.filter(pk=hold.pk))
+            return
+        TripReservation.objects.filter(pk=hold.pk).update(quantity=F('quantity') - quantity)
+        Trip.objects.filter(pk=trip_id).update(quantity_reserved=F('quantity_reserved') - quantity)
+        touch_trips([trip_id])
+
+
+def _delete_hold(holds, pk, trip_id, quantity):
+    # The hold must still match the query and still be this size: a hold extended in the
+    # meantime holds more seats than were read, and usually no longer expires now.
+    with transaction.atomic():
+        deleted, _ = holds.filter(pk=pk, quantity=quantity).delete()
+        if not deleted:
+            # Someone else deleted or changed it first and has dealt with its seats.
+            return False
+        Trip.objects.filter(pk=trip_id).update(quantity_reserved=F('quantity_reserved') - quantity)
+    return True
+
+
+def delete_holds(holds):
+    """
+    Purpose: Delete holds and give their seats back to their trips, counting only the rows this call deletes
+    Args: holds -- (QuerySet) the TripReservations to delete
+    Returns: (integer) number of holds removed
+    """
+    deleted = 0
+    released = defaultdict(int)
+    for pk, trip_id, quantity in list(holds.values_list('pk', 'trip_id', 'quantity')):
+        if _delete_hold(holds, pk, trip_id, quantity):
+            deleted += 1
+            released[trip_id] += quantity
+    if released:
+        # The trip pages show the seats left.
+        touch_trips(list(released))
+    return deleted
+
+
+def expire_holds(trip_ids=None):
+    """
+    Purpose: Delete holds whose time is up so their seats can be booked again
+    Args: trip_ids -- (list) only look at these trips; None sweeps every trip
+    Returns: (integer) number of holds removed
+    """
+    expired = TripReservation.objects.filter(expires_at__lte=timezone.now())
+    if trip_ids is not None:
+        expired = expired.filter(trip_id__in=trip_ids)
+    return delete_holds(expired)
@@ -0,0 +1,297 @@
+"""
+Synthetic data, a scratch database and the booking funnel, for benchmarks.
+
+The benchmark commands never touch the configured database. scratch_database
+points the default connection at a new, migrated SQLite file for the length
+of a with block, generate_data fills it with a repeatable synthetic catalog
+(users, trip types, trips, reviews and placed orders), and Funnel walks a
+visitor through the real URL routes:
+
+    index -> trips -> search -> single_trip -> add_to_cart -> cart
+          -> checkout -> order_confirmation
+
+timing every request and counting its SQL queries. See the benchmark_funnel
+command for the report and the stored baseline it is compared with.
+"""
+import json
+import os
+import random
+import tempfile
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from website import reviews, search
+from website.instrumentation import count_queries
+from website.models import Order, PaymentType, Trip, TripOrder, TripReview, TripType
+
+WORDS = (
+    'alpine', 'coastal', 'desert', 'island', 'canyon', 'glacier', 'vineyard', 'safari', 'rainforest',
+    'volcano', 'lakeside', 'highland', 'river', 'reef', 'tundra', 'meadow', 'harbor', 'summit',
+)
+KINDS = ('retreat', 'trek', 'escape', 'tour', 'expedition', 'getaway', 'cruise', 'adventure')
+LOCATIONS = (
+    'Nashville', 'Reykjavik', 'Kyoto', 'Cusco', 'Cape Town', 'Queenstown', 'Lisbon', 'Banff',
+    'Marrakesh', 'Hanoi', 'Patagonia', 'Santorini',
+)
+
+FUNNEL_STEPS = (
+    'website:index', 'website:list_trips', 'website:search', 'website:single_trip',
+    'website:add_trip_to_order', 'website:cart', 'website:checkout', 'website:order_confirmation',
+)
+
+
+def percentile(samples, fraction):
+    """
+    Purpose: Pick a percentile from a list of measurements (nearest rank)
+    Args: samples -- (list) numbers, fraction -- (float) e.g. 0.95
+    Returns: the sample at that rank, or 0.0 for no samples
+    """
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def _switch_default(settings_dict):
+    connections['default'].close()
+    del connections['default']
+    connections.databases['default'] = settings_dict
+
+
+@contextmanager
+def scratch_database(**overrides):
+    """
+    Purpose: Run a block against a freshly migrated SQLite file instead of the configured database
+    Args: overrides -- settings to override for the block; replicas and the catalog page
+        cache are switched off and the test client's host allowed unless given
+    Returns: (context manager) yields the scratch file's path; the file is deleted afterwards
+    """
+    original = connections.databases['default']
+    handle, path = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(handle)
+    overrides.setdefault('DATABASE_REPLICAS', [])
+    # Benchmarks go through the real views; the page cache would hide them.
+    overrides.setdefault('CATALOG_PAGE_CACHE', False)
+    overrides.setdefault('ALLOWED_HOSTS', ['testserver'])
+    _switch_default(dict(original, ENGINE='travelpackweb.sqlite3', NAME=path, TEST={}))
+    try:
+        with override_settings(**overrides):
+            call_command('migrate', verbosity=0)
+            yield path
+    finally:
+        _switch_default(original)
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def generate_data(users=50, trip_types=8, trips=500, reviews_per_trip=4, orders=300, seed=0):
+    """
+    Purpose: Fill the (scratch) database with a repeatable synthetic catalog
+    Args: users, trip_types, trips -- (integer) how many of each to create
+        reviews_per_trip -- (integer) average reviews per trip
+        orders -- (integer) placed orders, one to three trips each
+        seed -- (integer) the same seed always gives the same data
+    Returns: (dict) the sizes of what was created, keyed by model
+    """
+    rng = random.Random(seed)
+    password = make_password('loadtest')
+    User.objects.bulk_create([
+        User(username='loadtest-{}'.format(number), email='loadtest-{}@example.com'.format(number),
+             password=password) for number in range(users)])
+    people = list(User.objects.filter(username__startswith='loadtest-').order_by('pk'))
+    PaymentType.objects.bulk_create([
+        PaymentType(payment_type_name='Visa', account_number=4000 + number, customer=user)
+        for number, user in enumerate(people)])
+
+    TripType.objects.bulk_create([
+        TripType(trip_type_name='{} trips'.format(WORDS[number % len(WORDS)].title()))
+        for number in range(trip_types)])
+    types = list(TripType.objects.order_by('pk'))
+
+    Trip.objects.bulk_create([Trip(
+        seller=rng.choice(people), trip_type=rng.choice(types),
+        title='{} {} {}'.format(rng.choice(WORDS).title(), rng.choice(KINDS), number),
+        location=rng.choice(LOCATIONS),
+        description=' '.join(rng.choice(WORDS) for word in range(30)),
+        price=Decimal(rng.randrange(5000, 500000)) / 100, num_of_nights=rng.randint(1, 14),
+        quantity=10 ** 6) for number in range(trips)])
+    trip_ids = list(Trip.objects.values_list('pk', flat=True))
+
+    TripReview.objects.bulk_create([TripReview(
+        trip_id=rng.choice(trip_ids), customer=rng.choice(people), rating=Decimal(rng.randint(2, 10)) / 2,
+        review_text='A {} trip.'.format(rng.choice(WORDS))) for number in range(trips * reviews_per_trip)])
+
+    prices = dict(Trip.objects.values_list('pk', 'price'))
+    now = timezone.now()
+    Order.objects.bulk_create([
+        Order(customer=rng.choice(people), active=False, order_date=now) for number in range(orders)])
+    lines = []
+    for order_id in Order.objects.filter(active=False).values_list('pk', flat=True):
+        order_lines = [TripOrder(order_id=order_id, trip_id=trip_id, quantity=rng.randint(1, 3))
+                       for trip_id in rng.sample(trip_ids, rng.randint(1, 3))]
+        # Placed orders carry the total frozen at checkout.
+        Order.objects.filter(pk=order_id).update(
+            total=sum(prices[line.trip_id] * line.quantity for line in order_lines))
+        lines.extend(order_lines)
+    TripOrder.objects.bulk_create(lines)
+
+    # bulk_create skips the signals that keep these up to date.
+    reviews.recompute_all()
+    search.rebuild_index()
+    return {
+        'users': users, 'trip_types': trip_types, 'trips': trips,
+        'reviews': trips * reviews_per_trip, 'orders': orders, 'seed': seed,
+    }
+
+
+class Funnel(object):
+    """
+    purpose: Walk visitors through the booking funnel and record each request's time and queries
+    args: seed -- (integer) seeds the choice of visitors, trips and search terms
+    returns: (None): N/A
+    """
+
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.samples = {step: {'seconds': [], 'queries': []} for step in FUNNEL_STEPS}
+        self.customers = list(User.objects.filter(username__startswith='loadtest-').order_by('pk'))
+        self.trip_ids = list(Trip.objects.values_list('pk', flat=True))
+
+    def request(self, client, step, method, path, data=None):
+        """
+        Purpose: Make one request and record it under its funnel step
+        Args: client -- the test Client, step -- (str) URL name, method -- 'get' or 'post',
+            path -- (str) URL, data -- (dict) query string or form data
+        Returns: the response, with any streamed body consumed
+        """
+        with count_queries() as counter:
+            started = time.perf_counter()
+            response = getattr(client, method)(path, data or {})
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise AssertionError('{} {} answered {}'.format(method.upper(), path, response.status_code))
+        self.samples[step]['seconds'].append(elapsed)
+        self.samples[step]['queries'].append(counter.queries)
+        return response
+
+    def visit(self):
+        """
+        Purpose: Take one visitor from the home page to a placed order
+        Args: None
+        Returns: (None): N/A
+        """
+        # CSRF is checked as in production, so every form post sends the token like a browser.
+        client = Client(enforce_csrf_checks=True)
+        trip_id = self.rng.choice(self.trip_ids)
+        self.request(client, 'website:index', 'get', reverse('website:index'))
+        self.request(client, 'website:list_trips', 'get', reverse('website:list_trips'))
+        self.request(client, 'website:search', 'get', reverse('website:search'),
+                     {'q': '{} {}'.format(self.rng.choice(WORDS), self.rng.choice(KINDS))})
+
+        # Signing in is not part of what is measured (password hashing would swamp it). It comes
+        # before the trip page, which only shows a signed-in visitor the Book Trip form.
+        customer = self.rng.choice(self.customers)
+        client.force_login(customer)
+        self.request(client, 'website:single_trip', 'get', reverse('website:single_trip', args=[trip_id]))
+        self.request(client, 'website:add_trip_to_order', 'post', reverse('website:add_trip_to_order', args=[trip_id]),
+                     self.form(client))
+        order = Order.objects.get(customer=customer, active=True)
+        self.request(client, 'website:cart', 'get', reverse('website:cart'))
+        self.request(client, 'website:checkout', 'post', reverse('website:checkout', args=[order.pk]),
+                     self.form(client))
+        self.request(client, 'website:order_confirmation', 'post', reverse('website:order_confirmation'), self.form(
+            client,
+            order_id=order.pk,
+            payment_type_id=PaymentType.objects.filter(customer=customer).values_list('pk', flat=True)[0],
+        ))
+
+    def form(self, client, **fields):
+        """
+        Purpose: Build the data of a form post, with the CSRF token the last page gave the client
+        Args: client -- the test Client, fields -- the form's other fields
+        Returns: (dict) the form data
+        """
+        fields['csrfmiddlewaretoken'] = client.cookies[settings.CSRF_COOKIE_NAME].value
+        return fields
+
+    def report(self):
+        """
+        Purpose: Summarize the recorded requests per funnel step
+        Args: None
+        Returns: (dict) step -> requests, p50_ms, p95_ms, p99_ms and queries (the most any request ran)
+        """
+        report = {}
+        for step in FUNNEL_STEPS:
+            seconds, queries = self.samples[step]['seconds'], self.samples[step]['queries']
+            report[step] = {
+                'requests': len(seconds),
+                'p50_ms': round(percentile(seconds, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(seconds, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(seconds, 0.99) * 1000, 2),
+                'queries': max(queries) if queries else 0,
+            }
+        return report
+
+
+def compare(report, baseline, tolerance, floor_ms=5.0):
+    """
+    Purpose: Find the funnel steps that got slower or run more queries than the baseline
+    Args: report -- (dict) from Funnel.report, baseline -- (dict) a stored report
+        tolerance -- (float) allowed p50 growth, e.g. 0.5 for +50%; p95, which a few slow
+            requests can move, may grow twice as much
+        floor_ms -- (float) p50 growth smaller than this many milliseconds (twice that for p95) is noise
+    Returns: (list) one message per regression, empty when there are none
+    """
+    regressions = []
+    for step, current in sorted(report.items()):
+        previous = baseline.get(step)
+        if previous is None:
+            continue
+        if current['queries'] > previous['queries']:
+            regressions.append('{}: {} queries, baseline {}'.format(step, current['queries'], previous['queries']))
+        for key, growth, floor in (('p50_ms', tolerance, floor_ms), ('p95_ms', 2 * tolerance, 2 * floor_ms)):
+            allowed = max(previous[key] * (1 + growth), previous[key] + floor)
+            if current[key] > allowed:
+                regressions.append('{}: {} {:.1f} ms, baseline {:.1f} ms (allowed {:.1f} ms)'.format(
+                    step, key[:3], current[key], previous[key], allowed))
+    return regressions
+
+
+def read_baseline(path):
+    """
+    Purpose: Load a stored funnel baseline
+    Args: path -- (str) the JSON file written by save_baseline
+    Returns: (dict) with 'data' (the generate_data sizes) and 'steps' (a Funnel report), or None if missing
+    """
+    try:
+        with open(path) as baseline_file:
+            return json.load(baseline_file)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(path, data, report):
+    """
+    Purpose: Store a funnel report as the baseline later runs are compared with
+    Args: path -- (str) JSON file to write, data -- (dict) the generate_data sizes, report -- (dict) the report
+    Returns: (None): N/A
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as baseline_file:
+        json.dump({'data': data, 'steps': report}, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write('\n')
@@ -0,0 +1,57 @@
+import timeit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.views import static
+
+from website import assets
+
+
+class Command(BaseCommand):
+    help = ('Compares serving a static file through django.views.static.serve (the old path) '
+            'with website.assets.serve, in process. Run build_assets first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', default='main.css', help='Static file to request.')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per case.')
+
+    def handle(self, *args, **options):
+        name, count = options['name'], options['requests']
+        entry = assets.read_manifest(settings.STATIC_ROOT)['files'].get(name)
+        if entry is None:
+            raise CommandError('{} is not in the STATIC_ROOT manifest; run build_assets first.'.format(name))
+        hashed = assets.hashed_name(name, entry['hash'])
+        factory = RequestFactory()
+
+        def fetch(view, path, **headers):
+            def run():
+                response = view(factory.get('/static/' + path, **headers), path)
+                body = b''.join(response) if response.streaming else response.content
+                response.close()
+                return response, len(body)
+            return run
+
+        def old(request, path):
+            return static.serve(request, path, document_root=settings.STATIC_ROOT)
+
+        def new(request, path):
+            return assets.serve(request, path, root_setting='STATIC_ROOT')
+
+        cases = [
+            ('old: full GET', fetch(old, name)),
+            ('old: revalidation', fetch(old, name, HTTP_IF_MODIFIED_SINCE=old(factory.get('/'), name)['Last-Modified'])),
+            ('new: full GET', fetch(new, hashed)),
+            ('new: full GET, gzip', fetch(new, hashed, HTTP_ACCEPT_ENCODING='gzip, br')),
+            ('new: revalidation', fetch(new, name, HTTP_IF_NONE_MATCH='"{}"'.format(entry['hash']))),
+        ]
+
+        self.stdout.write('{:<24} {:>8} {:>10} {:>8}  {}'.format('case', 'status', 'bytes', 'us/req', 'Cache-Control'))
+        for label, run in cases:
+            response, size = run()
+            seconds = timeit.timeit(run, number=count)
+            self.stdout.write('{:<24} {:>8} {:>10} {:>8.1f}  {}'.format(
+                label, response.status_code, size, seconds / count * 1e6, response.get('Cache-Control', '-')))
+        self.stdout.write(
+            'With the old path a returning visitor revalidates every asset on every page; '
+            'fingerprinted URLs are not requested again until the file changes.')
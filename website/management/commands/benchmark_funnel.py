@@ -0,0 +1,66 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from website import loadtest
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'funnel.json')
+
+
+class Command(BaseCommand):
+    help = ('Generates a synthetic catalog in a scratch database, walks visitors through the '
+            'booking funnel (browse, search, trip page, add to cart, checkout, confirmation) and '
+            'reports p50/p95/p99 latency and queries per view. Fails when a view got slower or runs '
+            'more queries than the stored baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--visits', type=int, default=100, help='Visitors to walk through the funnel.')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--trip-types', type=int, default=8)
+        parser.add_argument('--trips', type=int, default=500)
+        parser.add_argument('--reviews-per-trip', type=int, default=4)
+        parser.add_argument('--orders', type=int, default=300)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file.')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Store this run as the baseline instead of comparing with it.')
+        parser.add_argument('--tolerance', type=float, default=0.5,
+                            help='Allowed p50 growth over the baseline (0.5: +50%%); p95 may grow twice as much.')
+
+    def handle(self, *args, **options):
+        with loadtest.scratch_database():
+            data = loadtest.generate_data(
+                users=options['users'], trip_types=options['trip_types'], trips=options['trips'],
+                reviews_per_trip=options['reviews_per_trip'], orders=options['orders'], seed=options['seed'])
+            funnel = loadtest.Funnel(seed=options['seed'])
+            # The first visit fills caches and compiles templates; it is not measured.
+            loadtest.Funnel(seed=options['seed'] + 1).visit()
+            for visit in range(options['visits']):
+                funnel.visit()
+            report = funnel.report()
+
+        self.stdout.write('{:<28} {:>8} {:>9} {:>9} {:>9} {:>8}'.format(
+            'view', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'queries'))
+        for step in loadtest.FUNNEL_STEPS:
+            row = report[step]
+            self.stdout.write('{:<28} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>8}'.format(
+                step, row['requests'], row['p50_ms'], row['p95_ms'], row['p99_ms'], row['queries']))
+
+        if options['save_baseline']:
+            loadtest.save_baseline(options['baseline'], data, report)
+            self.stdout.write('Saved the baseline to {}.'.format(options['baseline']))
+            return
+
+        baseline = loadtest.read_baseline(options['baseline'])
+        if baseline is None:
+            self.stdout.write('No baseline at {}; run with --save-baseline to store one.'.format(options['baseline']))
+            return
+        if baseline['data'] != data:
+            raise CommandError('The baseline was taken with other data sizes ({}); run with the same '
+                               'options or store a new baseline.'.format(baseline['data']))
+
+        regressions = loadtest.compare(report, baseline['steps'], options['tolerance'])
+        if regressions:
+            raise CommandError('Slower than the baseline:\n  ' + '\n  '.join(regressions))
+        self.stdout.write('No regressions against {}.'.format(options['baseline']))
@@ -0,0 +1,131 @@
+import random
+import threading
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test import RequestFactory
+
+from website import views
+from website.loadtest import percentile, scratch_database
+from website.models import Order, PaymentType, Trip, TripType
+
+
+class Command(BaseCommand):
+    help = ('Runs the catalog and the cart/checkout flow concurrently against a scratch SQLite '
+            'database, once with SQLite\'s defaults and once with SQLITE_PRAGMAS and '
+            'SQLITE_IMMEDIATE_TRANSACTIONS, and compares throughput, latency and '
+            '"database is locked" errors.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=10, help='How long each profile runs.')
+        parser.add_argument('--readers', type=int, default=4, help='Threads browsing the catalog.')
+        parser.add_argument('--writers', type=int, default=4, help='Threads adding to cart and checking out.')
+        parser.add_argument('--trips', type=int, default=50, help='Trips in the scratch database.')
+
+    def handle(self, *args, **options):
+        profiles = [
+            ('defaults', {'SQLITE_PRAGMAS': {}, 'SQLITE_IMMEDIATE_TRANSACTIONS': False}),
+            ('tuned', {'SQLITE_PRAGMAS': settings.SQLITE_PRAGMAS,
+                       'SQLITE_IMMEDIATE_TRANSACTIONS': settings.SQLITE_IMMEDIATE_TRANSACTIONS}),
+        ]
+        self.stdout.write('{:<16} {:<9} {:>8} {:>8} {:>9} {:>9} {:>7}'.format(
+            'profile', 'flow', 'ops', 'ops/s', 'p50 ms', 'p95 ms', 'locked'))
+        for label, tuning in profiles:
+            results = self.run_profile(tuning, options)
+            for flow in ('catalog', 'checkout'):
+                timings, locked = results[flow]
+                self.stdout.write('{:<16} {:<9} {:>8} {:>8.1f} {:>9.1f} {:>9.1f} {:>7}'.format(
+                    label, flow, len(timings), len(timings) / options['seconds'],
+                    percentile(timings, 0.5) * 1000, percentile(timings, 0.95) * 1000, locked))
+
+    def run_profile(self, tuning, options):
+        """
+        Purpose: Time both flows against a freshly migrated scratch database
+        Args: tuning -- (dict) the SQLite settings for this run, options -- the command's options
+        Returns: (dict) flow -> (list of seconds per completed iteration, number of locked errors)
+        """
+        with scratch_database(**tuning):
+            customers, trip_ids = self.seed(options['writers'], options['trips'])
+            return self.run_threads(customers, trip_ids, options)
+
+    def seed(self, writers, trips):
+        seller = User.objects.create_user(username='benchmark-seller', password='benchmark')
+        trip_type = TripType.objects.create(trip_type_name='Benchmark')
+        Trip.objects.bulk_create([Trip(
+            seller=seller, trip_type=trip_type, title='Benchmark trip {}'.format(number),
+            description='Benchmark', price=100, location='Nashville', num_of_nights=3,
+            quantity=10 ** 6) for number in range(trips)])
+        customers = []
+        for number in range(writers):
+            customer = User.objects.create_user(username='benchmark-{}'.format(number), password='benchmark')
+            PaymentType.objects.create(
+                payment_type_name='Card', account_number=4111, customer=customer)
+            customers.append(customer)
+        return customers, list(Trip.objects.values_list('pk', flat=True))
+
+    def run_threads(self, customers, trip_ids, options):
+        deadline = time.time() + options['seconds']
+        results = {'catalog': ([], [0]), 'checkout': ([], [0])}
+        lock = threading.Lock()
+
+        def loop(flow, step):
+            timings, locked = [], 0
+            try:
+                while time.time() < deadline:
+                    started = time.time()
+                    try:
+                        step()
+                    except OperationalError:
+                        locked += 1
+                        continue
+                    timings.append(time.time() - started)
+            finally:
+                connection.close()
+            with lock:
+                results[flow][0].extend(timings)
+                results[flow][1][0] += locked
+
+        factory = RequestFactory()
+        session_store = import_module(settings.SESSION_ENGINE).SessionStore
+
+        def call(view, request, user, session=None, **kwargs):
+            request.user = user
+            # The cart views keep the cart in the session; it is not saved between requests here.
+            request.session = session if session is not None else session_store()
+            response = view(request, **kwargs)
+            if response.streaming:
+                b''.join(response)
+            return response
+
+        def browse():
+            def step():
+                call(views.list_trips, factory.get('/trips'), AnonymousUser())
+                call(views.single_trip, factory.get('/single_trip/'), AnonymousUser(),
+                     trip_id=random.choice(trip_ids))
+            loop('catalog', step)
+
+        def buy(customer):
+            payment_type_id = PaymentType.objects.get(customer=customer).pk
+            session = session_store()
+
+            def step():
+                call(views.add_trip_to_order, factory.get('/add_to_cart/'), customer, session,
+                     trip_id=random.choice(trip_ids))
+                call(views.view_cart, factory.get('/cart'), customer, session)
+                order_id = Order.objects.get(customer=customer, active=1).pk
+                call(views.order_confirmation, factory.post(
+                    '/order_confirmation', {'order_id': order_id, 'payment_type_id': payment_type_id}),
+                    customer, session)
+            loop('checkout', step)
+
+        threads = [threading.Thread(target=browse) for number in range(options['readers'])]
+        threads += [threading.Thread(target=buy, args=(customer,)) for customer in customers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {flow: (timings, locked[0]) for flow, (timings, locked) in results.items()}
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from website import assets
+
+
+class Command(BaseCommand):
+    help = ('Collects static files, then fingerprints and precompresses everything under STATIC_ROOT and '
+            'MEDIA_ROOT and writes their assets.json manifests. Run it on every deploy.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--skip-collectstatic', action='store_true',
+            help='Only rebuild the manifests; do not run collectstatic first.')
+
+    def handle(self, *args, **options):
+        if not options['skip_collectstatic']:
+            call_command('collectstatic', interactive=False, verbosity=0)
+
+        for setting in ('STATIC_ROOT', 'MEDIA_ROOT'):
+            root = getattr(settings, setting)
+            manifest = assets.build_manifest(root)
+            compressed = sum(1 for entry in manifest['files'].values() if entry['encodings'])
+            self.stdout.write('{}: fingerprinted {} files, {} precompressed.'.format(
+                setting, len(manifest['files']), compressed))
+        if assets.brotli is None:
+            self.stdout.write('Install the brotli package to also write .br copies.')
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from website import order_export
+
+
+class Command(BaseCommand):
+    help = ('Exports every placed order with its trip lines, payment type and totals as CSV or JSON Lines, '
+            'streamed in constant memory.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=order_export.FORMATS, default='csv', help='Export format.')
+        parser.add_argument(
+            '--since', help='Only orders placed at or after this date (YYYY-MM-DD) or date and time.')
+        parser.add_argument('--before', help='Only orders placed before this date or date and time.')
+        parser.add_argument('--output', help='File to write; standard output by default.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Orders loaded per query.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+        try:
+            start = order_export.parse_bound(options['since']) if options['since'] else None
+            end = order_export.parse_bound(options['before']) if options['before'] else None
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        chunks = order_export.export_chunks(options['format'], start, end, options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from website import thumbnail_gc
+
+
+class Command(BaseCommand):
+    help = ('Deletes thumbnails and renditions no current trip image uses and keeps media/cache '
+            'under THUMBNAIL_CACHE_MAX_BYTES by evicting the least recently used files. Run it from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report what would be deleted without deleting anything.')
+        parser.add_argument(
+            '--max-bytes', type=int, default=settings.THUMBNAIL_CACHE_MAX_BYTES,
+            help='Size cap for media/cache in bytes; 0 means no cap.')
+        parser.add_argument(
+            '--min-age', type=int, default=settings.THUMBNAIL_GC_MIN_AGE,
+            help='Seconds a file must have existed before it can be treated as an orphan.')
+
+    def handle(self, *args, **options):
+        report = thumbnail_gc.collect_garbage(
+            max_bytes=options['max_bytes'] or None,
+            min_age=options['min_age'],
+            dry_run=options['dry_run'],
+        )
+
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write('Scanned {} files ({}).'.format(report['scanned'], filesizeformat(report['scanned_bytes'])))
+        self.stdout.write('{} {} orphaned files ({}).'.format(
+            verb, report['orphans'], filesizeformat(report['orphan_bytes'])))
+        self.stdout.write('{} {} least recently used thumbnails ({}) to stay under the cap.'.format(
+            verb, report['evicted'], filesizeformat(report['evicted_bytes'])))
+        self.stdout.write('{} {}; the thumbnail cache {} {}.'.format(
+            'Would reclaim' if options['dry_run'] else 'Reclaimed',
+            filesizeformat(report['orphan_bytes'] + report['evicted_bytes']),
+            'would hold' if options['dry_run'] else 'now holds',
+            filesizeformat(report['cache_bytes'])))
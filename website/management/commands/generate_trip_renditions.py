@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from website import images
+from website.models import Trip
+
+
+class Command(BaseCommand):
+    help = 'Generates the card and hero image renditions for trips that do not have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Regenerate renditions for every trip with an image, not just the missing ones.')
+        parser.add_argument(
+            '--workers', type=int, default=settings.TRIP_IMAGE_WORKERS,
+            help='Number of images processed in parallel.')
+
+    def handle(self, *args, **options):
+        trips = Trip.objects.exclude(trip_img='').exclude(trip_img__isnull=True).order_by('pk')
+        jobs = [
+            (trip.pk, trip.trip_img.name)
+            for trip in trips.only('pk', 'trip_img', 'trip_img_renditions').iterator()
+            if options['force'] or images.needs_renditions(trip)
+        ]
+
+        def run(job):
+            try:
+                images.generate_for_trip(*job)
+                return job, None
+            except Exception as error:
+                return job, error
+
+        def run_in_worker(job):
+            try:
+                return run(job)
+            finally:
+                # Each worker thread has its own database connection.
+                connection.close()
+
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                results = list(pool.map(run_in_worker, jobs))
+        else:
+            results = [run(job) for job in jobs]
+
+        failed = 0
+        for (trip_id, image_name), error in results:
+            if error is not None:
+                failed += 1
+                self.stderr.write('Trip {} ({}): {}'.format(trip_id, image_name, error))
+
+        self.stdout.write('Generated renditions for {} of {} trips.'.format(len(jobs) - failed, len(jobs)))
@@ -0,0 +1,58 @@
+import io
+import os
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from website import catalog_import
+
+
+class Command(BaseCommand):
+    help = ('Creates or updates trips from a supplier catalog in JSON Lines or CSV, matched on external_id. '
+            'See website/catalog_import.py for the record format.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Catalog file to import, or - to read standard input.')
+        parser.add_argument(
+            '--format', choices=catalog_import.FORMATS,
+            help='Catalog format; by default csv for .csv files and jsonl otherwise.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Records written per bulk insert/update (and per transaction).')
+        parser.add_argument(
+            '--images', action='store_true',
+            help='Fetch each new or changed trip image into storage and make its renditions.')
+        parser.add_argument(
+            '--workers', type=int, default=settings.TRIP_IMAGE_WORKERS,
+            help='Number of images fetched and resized in parallel.')
+        parser.add_argument(
+            '--image-root',
+            help='Directory relative image paths are read from; by default the catalog file\'s directory.')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+        path = options['path']
+        format_name = options['format'] or catalog_import.guess_format(path)
+        image_root = options['image_root'] or (os.getcwd() if path == '-' else os.path.dirname(os.path.abspath(path)))
+
+        if path == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+        else:
+            try:
+                stream = open(path, encoding='utf-8', newline='')
+            except OSError as error:
+                raise CommandError('Cannot read {}: {}'.format(path, error))
+
+        importer = catalog_import.TripImporter(
+            fetch_images=options['images'], workers=options['workers'], image_root=image_root)
+        with stream:
+            result = importer.run(catalog_import.read_records(stream, format_name), options['chunk_size'])
+
+        for number, message in importer.errors:
+            self.stderr.write('Line {}: {}'.format(number, message))
+        self.stdout.write('Created {created}, updated {updated} and left {unchanged} trips unchanged; '
+                          '{failed} records failed.'.format(**result))
+        if options['images']:
+            self.stdout.write('Imported {images} images ({image_errors} failed).'.format(**result))
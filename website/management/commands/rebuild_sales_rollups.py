@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from website import sales
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily sales rollups by trip, trip type and seller from every placed order.'
+
+    def handle(self, *args, **options):
+        written = sales.rebuild_all()
+        for name, rows in sorted(written.items()):
+            self.stdout.write('{}: {} rows.'.format(name, rows))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from website import search
+
+
+class Command(BaseCommand):
+    help = 'Empties the trip search index and re-indexes every trip.'
+
+    def handle(self, *args, **options):
+        indexed = search.rebuild_index()
+        self.stdout.write('Indexed {} trips with the {} backend.'.format(indexed, search.get_backend().name))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from website import reviews
+
+
+class Command(BaseCommand):
+    help = "Recomputes every trip's rating count, sum, average and histogram from its reviews."
+
+    def handle(self, *args, **options):
+        reviewed = reviews.recompute_all()
+        self.stdout.write('Recomputed review aggregates; {} trips have reviews.'.format(reviewed))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from website import inventory
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired cart seat holds so their seats can be booked again. Run it from cron.'
+
+    def handle(self, *args, **options):
+        expired = inventory.expire_holds()
+        self.stdout.write('Released {} expired seat holds.'.format(expired))
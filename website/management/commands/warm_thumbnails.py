@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from website import thumbnails
+from website.models import Trip
+
+
+class Command(BaseCommand):
+    help = 'Generates the thumbnails templates use for every trip image and records them in the thumbnail store.'
+
+    def handle(self, *args, **options):
+        trips = Trip.objects.exclude(trip_img='').exclude(trip_img__isnull=True).order_by('pk')
+        warmed, failed = thumbnails.warm_trip_thumbnails(trips.only('pk', 'title', 'trip_img').iterator())
+
+        for trip, error in failed:
+            self.stderr.write('Trip {} ({}): {}'.format(trip.pk, trip.trip_img.name, error))
+
+        self.stdout.write('Warmed thumbnails for {} trip images ({} failed).'.format(warmed, len(failed)))
+        stats = thumbnails.kvstore_stats()
+        if stats is not None:
+            self.stdout.write(
+                'Thumbnail store: {hits} hits, {misses} misses, {entries} entries, {evictions} evictions.'.format(**stats))
@@ -0,0 +1,201 @@
+"""
+In-process metrics in the Prometheus text format.
+
+website/instrumentation.py observes every request into the histograms below.
+The /metrics view renders them with render(), together with the catalog
+cache and thumbnail store counters those modules keep.
+
+Like those counters, everything here lives in one process: when the site runs
+several worker processes, each one must be scraped on its own (or the numbers
+read as a sample of the traffic).
+"""
+import threading
+
+from website import catalog_cache, thumbnails
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = ('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in labels)
+    return '{' + ','.join(escaped) + '}'
+
+
+class Histogram(object):
+    """
+    purpose: A Prometheus histogram with one series per combination of label values
+    args: name -- (str) metric name, documentation -- (str) its HELP text,
+        label_names -- (tuple) label names, buckets -- (tuple) upper bounds, ascending
+    returns: (None): N/A
+    """
+
+    def __init__(self, name, documentation, label_names, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """
+        Purpose: Count one observation
+        Args: value -- (number) what was measured, label_values -- in the order of label_names
+        Returns: (None): N/A
+        """
+        with self.lock:
+            counts, total = self.series.get(label_values, ([0] * len(self.buckets), 0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self.series[label_values] = (counts, total + value)
+
+    def samples(self):
+        """
+        Purpose: List the histogram's samples the way Prometheus expects them, cumulative per bucket
+        Args: None
+        Returns: (list) (name, labels, value) tuples; labels are (name, value) pairs
+        """
+        with self.lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self.series.items())
+        samples = []
+        for label_values, counts, total in series:
+            labels = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', labels + [('le', _format_value(float(bound)))], cumulative))
+            samples.append((self.name + '_sum', labels, total))
+            samples.append((self.name + '_count', labels, cumulative))
+        return samples
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+
+class Counter(object):
+    """
+    purpose: A Prometheus counter with one series per combination of label values
+    args: name -- (str) metric name ending in _total, documentation -- (str) its HELP text,
+        label_names -- (tuple) label names
+    returns: (None): N/A
+    """
+
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + 1
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, list(zip(self.label_names, labels)), value)
+                    for labels, value in sorted(self.series.items())]
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+
+REQUEST_LABELS = ('view', 'method')
+
+REQUEST_DURATION = Histogram(
+    'travelpack_request_duration_seconds', 'Wall time from the first middleware in to the response out.',
+    REQUEST_LABELS, SECONDS_BUCKETS)
+REQUEST_QUERIES = Histogram(
+    'travelpack_request_queries', 'SQL queries run while handling a request.', REQUEST_LABELS, QUERY_BUCKETS)
+REQUEST_SQL_DURATION = Histogram(
+    'travelpack_request_sql_seconds', 'Time spent in SQL queries while handling a request.',
+    REQUEST_LABELS, SECONDS_BUCKETS)
+REQUEST_TEMPLATE_DURATION = Histogram(
+    'travelpack_request_template_seconds', 'Time spent rendering templates while handling a request.',
+    REQUEST_LABELS, SECONDS_BUCKETS)
+RESPONSE_SIZE = Histogram(
+    'travelpack_response_size_bytes', 'Size of response bodies; streamed responses are not counted.',
+    REQUEST_LABELS, BYTES_BUCKETS)
+QUERY_BUDGET_EXCEEDED = Counter(
+    'travelpack_query_budget_exceeded_total', 'Requests that ran more SQL queries than their view\'s budget.',
+    ('view',))
+
+REQUEST_METRICS = (
+    REQUEST_DURATION, REQUEST_QUERIES, REQUEST_SQL_DURATION, REQUEST_TEMPLATE_DURATION, RESPONSE_SIZE,
+    QUERY_BUDGET_EXCEEDED,
+)
+
+
+def _cache_samples():
+    # (metric name, type, help, samples) for the counters other modules keep.
+    lookups = []
+    for name, counts in sorted(catalog_cache.stats().items()):
+        lookups.append(('travelpack_catalog_cache_lookups_total', [('name', name), ('result', 'hit')], counts['hits']))
+        lookups.append(('travelpack_catalog_cache_lookups_total', [('name', name), ('result', 'miss')], counts['misses']))
+
+    families = [('travelpack_catalog_cache_lookups_total', 'counter',
+                 'Catalog page and fragment cache lookups, by page or fragment name.', lookups)]
+
+    store = thumbnails.kvstore_stats()
+    if store is not None:
+        families += [
+            ('travelpack_thumbnail_store_lookups_total', 'counter',
+             'Lookups in the in-process thumbnail store, by result.',
+             [('travelpack_thumbnail_store_lookups_total', [('result', 'hit')], store['hits']),
+              ('travelpack_thumbnail_store_lookups_total', [('result', 'miss')], store['misses'])]),
+            ('travelpack_thumbnail_store_evictions_total', 'counter',
+             'Entries evicted from the in-process thumbnail store.',
+             [('travelpack_thumbnail_store_evictions_total', [], store['evictions'])]),
+            ('travelpack_thumbnail_store_bytes', 'gauge', 'Estimated size of the in-process thumbnail store.',
+             [('travelpack_thumbnail_store_bytes', [], store['bytes'])]),
+        ]
+    return families
+
+
+def render():
+    """
+    Purpose: Write every metric in the Prometheus text exposition format
+    Args: None
+    Returns: (str) the exposition, ending in a newline
+    """
+    families = [(metric.name, 'histogram' if isinstance(metric, Histogram) else 'counter',
+                 metric.documentation, metric.samples()) for metric in REQUEST_METRICS]
+    families += _cache_samples()
+
+    lines = []
+    for name, kind, documentation, samples in families:
+        lines.append('# HELP {} {}'.format(name, documentation))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for sample_name, labels, value in samples:
+            lines.append('{}{} {}'.format(sample_name, _format_labels(labels), _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """
+    Purpose: Forget every request observation (the cache counters have their own resets)
+    Args: None
+    Returns: (None): N/A
+    """
+    for metric in REQUEST_METRICS:
+        metric.clear()
+
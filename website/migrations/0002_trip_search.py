@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.utils import OperationalError
+import django.db.models.deletion
+
+
+def create_fts_table(apps, schema_editor):
+    # Only SQLite has FTS5; other databases use the TripSearchTerm fallback.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE website_trip_fts USING fts5("
+            "title, location, description, tokenize = 'unicode61 remove_diacritics 1')")
+    except OperationalError:
+        # SQLite was built without FTS5.
+        return
+    schema_editor.execute(
+        "INSERT INTO website_trip_fts (rowid, title, location, description) "
+        "SELECT id, title, location, description FROM website_trip")
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS website_trip_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripSearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(db_index=True, max_length=64)),
+                ('field', models.CharField(max_length=16)),
+                ('frequency', models.PositiveIntegerField(default=1)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='website.Trip')),
+            ],
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:25
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def compute_existing_aggregates(apps, schema_editor):
+    Trip = apps.get_model('website', 'Trip')
+    TripReview = apps.get_model('website', 'TripReview')
+    TripRatingBucket = apps.get_model('website', 'TripRatingBucket')
+    db = schema_editor.connection.alias
+
+    counts = defaultdict(int)
+    sums = defaultdict(Decimal)
+    histograms = defaultdict(lambda: defaultdict(int))
+    for trip_id, rating in TripReview.objects.using(db).values_list('trip_id', 'rating').iterator():
+        counts[trip_id] += 1
+        sums[trip_id] += rating
+        histograms[trip_id][int(rating)] += 1
+
+    for trip_id, count in counts.items():
+        Trip.objects.using(db).filter(pk=trip_id).update(
+            rating_count=count, rating_sum=sums[trip_id], rating_average=sums[trip_id] / count)
+    TripRatingBucket.objects.using(db).bulk_create(
+        TripRatingBucket(trip_id=trip_id, bucket=bucket, count=count)
+        for trip_id, histogram in histograms.items()
+        for bucket, count in histogram.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0002_trip_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripRatingBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('-bucket',),
+            },
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='rating_average',
+            field=models.DecimalField(blank=True, db_index=True, decimal_places=2, max_digits=4, null=True),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='rating_sum',
+            field=models.DecimalField(decimal_places=1, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='tripratingbucket',
+            name='trip',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_buckets', to='website.Trip'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tripratingbucket',
+            unique_together=set([('trip', 'bucket')]),
+        ),
+        migrations.RunPython(compute_existing_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0003_trip_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TripReservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='website.Order')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='quantity_reserved',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tripreservation',
+            name='trip',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='website.Trip'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='tripreservation',
+            unique_together=set([('order', 'trip')]),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def freeze_placed_order_totals(apps, schema_editor):
+    Order = apps.get_model('website', 'Order')
+    TripOrder = apps.get_model('website', 'TripOrder')
+    db = schema_editor.connection.alias
+
+    totals = (TripOrder.objects.using(db).filter(order__active=False).order_by()
+              .values_list('order').annotate(total=Sum('trip__price')))
+    for order_id, total in totals:
+        Order.objects.using(db).filter(pk=order_id).update(total=total)
+    Order.objects.using(db).filter(active=False, total__isnull=True).update(total=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0004_trip_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.RunPython(freeze_placed_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def collapse_duplicate_lines(apps, schema_editor):
+    TripOrder = apps.get_model('website', 'TripOrder')
+    db = schema_editor.connection.alias
+
+    duplicates = (TripOrder.objects.using(db).order_by().values('order', 'trip')
+                  .annotate(lines=Count('id'), keep=Min('id')).filter(lines__gt=1))
+    for group in duplicates:
+        TripOrder.objects.using(db).filter(pk=group['keep']).update(quantity=group['lines'])
+        TripOrder.objects.using(db).filter(order=group['order'], trip=group['trip']).exclude(pk=group['keep']).delete()
+
+
+def expand_quantities(apps, schema_editor):
+    TripOrder = apps.get_model('website', 'TripOrder')
+    db = schema_editor.connection.alias
+
+    for line in TripOrder.objects.using(db).filter(quantity__gt=1):
+        TripOrder.objects.using(db).bulk_create(
+            TripOrder(order_id=line.order_id, trip_id=line.trip_id) for _ in range(line.quantity - 1))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0005_order_total'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='triporder',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(collapse_duplicate_lines, expand_quantities),
+        migrations.AlterUniqueTogether(
+            name='triporder',
+            unique_together=set([('order', 'trip')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:34
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0006_triporder_quantity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='trip_img_renditions',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+# Django 1.11 cannot declare partial indexes on a model, so this one is plain SQL.
+# SQLite only matches a partial index whose condition is written the way the query
+# compares the column (Django sends active = 1); PostgreSQL needs a real boolean.
+OPEN_ORDER_INDEX_CONDITIONS = {
+    'sqlite': 'active = 1',
+    'postgresql': 'active',
+}
+
+
+def create_open_order_index(apps, schema_editor):
+    condition = OPEN_ORDER_INDEX_CONDITIONS.get(schema_editor.connection.vendor)
+    if condition is None:
+        # Other databases make do with order_customer_history_idx.
+        return
+    schema_editor.execute(
+        "CREATE INDEX order_open_customer_idx ON website_order (customer_id) WHERE {}".format(condition))
+
+
+def drop_open_order_index(apps, schema_editor):
+    if schema_editor.connection.vendor in OPEN_ORDER_INDEX_CONDITIONS:
+        schema_editor.execute("DROP INDEX IF EXISTS order_open_customer_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0007_trip_img_renditions'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'active', 'order_date'], name='order_customer_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['title', 'id'], name='trip_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['trip_type', '-id'], name='trip_type_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripreview',
+            index=models.Index(fields=['trip', '-id'], name='review_trip_newest_idx'),
+        ),
+        migrations.RunPython(create_open_order_index, drop_open_order_index),
+    ]
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count
+
+
+# A partial unique index: at most one open order (cart) per customer. It replaces
+# order_open_customer_idx from 0008 and serves the same lookups. Conditions are
+# written as in 0008; other databases get no constraint.
+OPEN_ORDER_INDEX_CONDITIONS = {
+    'sqlite': 'active = 1',
+    'postgresql': 'active',
+}
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    # Carts created twice by the old get-or-create race: move every line and
+    # seat hold onto the customer's oldest cart before the index forbids them.
+    db = schema_editor.connection.alias
+    Order = apps.get_model('website', 'Order')
+    TripOrder = apps.get_model('website', 'TripOrder')
+    TripReservation = apps.get_model('website', 'TripReservation')
+
+    customers = (Order.objects.using(db).filter(active=True).values('customer')
+                 .annotate(carts=Count('id')).filter(carts__gt=1).values_list('customer', flat=True))
+    for customer_id in list(customers):
+        keeper, *duplicates = Order.objects.using(db).filter(customer_id=customer_id, active=True).order_by('pk')
+        for duplicate in duplicates:
+            for model in (TripOrder, TripReservation):
+                for row in model.objects.using(db).filter(order=duplicate):
+                    kept = model.objects.using(db).filter(order=keeper, trip_id=row.trip_id).first()
+                    if kept is None:
+                        row.order = keeper
+                        row.save()
+                        continue
+                    kept.quantity += row.quantity
+                    if model is TripReservation:
+                        kept.expires_at = max(kept.expires_at, row.expires_at)
+                    kept.save()
+                    row.delete()
+            duplicate.delete()
+
+
+def create_unique_open_order_index(apps, schema_editor):
+    condition = OPEN_ORDER_INDEX_CONDITIONS.get(schema_editor.connection.vendor)
+    if condition is None:
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS order_open_customer_idx")
+    schema_editor.execute(
+        "CREATE UNIQUE INDEX order_open_cart_idx ON website_order (customer_id) WHERE {}".format(condition))
+
+
+def drop_unique_open_order_index(apps, schema_editor):
+    condition = OPEN_ORDER_INDEX_CONDITIONS.get(schema_editor.connection.vendor)
+    if condition is None:
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS order_open_cart_idx")
+    schema_editor.execute(
+        "CREATE INDEX order_open_customer_idx ON website_order (customer_id) WHERE {}".format(condition))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('website', '0008_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+        migrations.RunPython(create_unique_open_order_index, drop_unique_open_order_index),
+    ]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 20:14
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def compute_existing_rollups(apps, schema_editor):
+    TripOrder = apps.get_model('website', 'TripOrder')
+    db = schema_editor.connection.alias
+    rollups = (
+        (apps.get_model('website', 'DailyTripSales'), 'trip_id'),
+        (apps.get_model('website', 'DailyTripTypeSales'), 'trip_type_id'),
+        (apps.get_model('website', 'DailySellerSales'), 'seller_id'),
+    )
+
+    totals = [defaultdict(lambda: [0, Decimal('0.00'), set()]) for rollup in rollups]
+    lines = (TripOrder.objects.using(db)
+             .filter(order__active=False, order__order_date__isnull=False)
+             .annotate(price=Coalesce('unit_price', 'trip__price'))
+             .values_list('order__order_date', 'order_id', 'quantity', 'price',
+                          'trip_id', 'trip__trip_type_id', 'trip__seller_id'))
+    for order_date, order_id, quantity, price, trip_id, trip_type_id, seller_id in lines.iterator():
+        day = timezone.localdate(order_date)
+        for rollup_totals, key in zip(totals, (trip_id, trip_type_id, seller_id)):
+            row = rollup_totals[(day, key)]
+            row[0] += quantity
+            row[1] += price * quantity
+            row[2].add(order_id)
+
+    for (model, field), rollup_totals in zip(rollups, totals):
+        model.objects.using(db).bulk_create([
+            model(day=day, units=units, revenue=revenue, orders=len(orders), **{field: key})
+            for (day, key), (units, revenue, orders) in rollup_totals.items()
+        ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('website', '0011_order_export'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySellerSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ('day',),
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyTripSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('trip', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='website.Trip')),
+            ],
+            options={
+                'ordering': ('day',),
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyTripTypeSales',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('trip_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='website.TripType')),
+            ],
+            options={
+                'ordering': ('day',),
+                'abstract': False,
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailytriptypesales',
+            unique_together=set([('day', 'trip_type')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailytripsales',
+            unique_together=set([('day', 'trip')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailysellersales',
+            unique_together=set([('day', 'seller')]),
+        ),
+        migrations.RunPython(compute_existing_rollups, migrations.RunPython.noop),
+    ]
@@ -1,11 +1,70 @@
 import datetime
+import json
 
 from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.core.urlresolvers import reverse
 from django.utils import timezone
+from django.utils.functional import cached_property
 from sorl.thumbnail import ImageField
 
+class TripTypeQuerySet(models.QuerySet):
+    """
+    purpose: Per-category trip statistics that cost a fixed number of queries however many categories there are
+    args: Extends the models.QuerySet Django class
+    returns: (None): N/A
+    """
+
+    def with_trip_counts(self):
+        """
+        Purpose: Annotate each trip type with how many trips it has, in the same query
+        Args: None
+        Returns: (TripTypeQuerySet) trip types carrying a num_trips attribute
+        """
+        return self.annotate(num_trips=models.Count('trip'))
+
+    def with_latest_trips(self, limit=3):
+        """
+        Purpose: Attach the newest trips of each trip type using one extra query for all types
+        Args: limit -- (integer) how many trips to attach per type
+        Returns: (list) the trip types, each with a trips attribute listing its newest trips first
+        """
+        trip_types = list(self)
+        trips_by_type = {trip_type.pk: [] for trip_type in trip_types}
+        latest = Trip.objects.latest_per_type(limit).filter(trip_type__in=list(trips_by_type))
+        for trip in latest.order_by('trip_type', '-pk'):
+            trips_by_type[trip.trip_type_id].append(trip)
+        for trip_type in trip_types:
+            trip_type.trips = trips_by_type[trip_type.pk]
+        return trip_types
+
+
+class TripQuerySet(models.QuerySet):
+    """
+    purpose: Reusable trip queries
+    args: Extends the models.QuerySet Django class
+    returns: (None): N/A
+    """
+
+    def latest_per_type(self, limit):
+        """
+        Purpose: Select the newest trips of every trip type in a single query
+        Args: limit -- (integer) how many trips to keep per type
+        Returns: (TripQuerySet) trips whose type has fewer than limit newer trips
+        """
+        # Django 1.11 has no window functions, so rank each trip with a correlated
+        # count of newer trips of the same type; this is portable to every backend.
+        newer_of_same_type = Trip.objects.filter(
+            trip_type=models.OuterRef('trip_type'),
+            pk__gt=models.OuterRef('pk'),
+        ).order_by().values('trip_type').annotate(newer=models.Count('pk')).values('newer')
+        return self.annotate(
+            newer_of_same_type=Coalesce(models.Subquery(newer_of_same_type, output_field=models.IntegerField()), 0),
+        ).filter(newer_of_same_type__lt=limit)
+
+
 class TripType(models.Model):                      
     """
     purpose: Instantiates a trip type
@@ -14,6 +73,8 @@ class TripType(models.Model):
     """   
     trip_type_name = models.CharField(max_length=255, null=True)
 
+    objects = TripTypeQuerySet.as_manager()
+
     def __str__(self):
         return self.trip_type_name
 
@@ -39,7 +100,27 @@ class Trip(models.Model):
     last_dep_date = models.DateField('Last Available Departure Date', null=True)
     quantity = models.IntegerField()
     quantity_sold = models.IntegerField(default=0)
+    # Seats held by carts (see website/inventory.py); quantity - quantity_reserved are free to book.
+    quantity_reserved = models.IntegerField(default=0)
     trip_img = models.ImageField(blank=True, null=True) 
+    # JSON map of rendition name -> storage path, written by website.images after upload.
+    trip_img_renditions = models.TextField(blank=True, default='')
+    # Review aggregates, kept up to date by website.reviews so listings never aggregate TripReview.
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0)
+    rating_average = models.DecimalField(max_digits=4, decimal_places=2, null=True, blank=True, db_index=True)
+    # The supplier's id for trips loaded by the import_trips command; re-imports update by it.
+    external_id = models.CharField(max_length=64, unique=True, null=True, blank=True)
+
+    objects = TripQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # All Trips sorted by title (keyset ordering ('title', 'id')).
+            models.Index(fields=['title', 'id'], name='trip_title_id_idx'),
+            # Newest trips of a type (trip categories page).
+            models.Index(fields=['trip_type', '-id'], name='trip_type_newest_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -47,6 +128,26 @@ class Trip(models.Model):
     def get_absolute_url(self):
         return "/single_trip/{}".format(self.id)
 
+    @property
+    def available(self):
+        return max(0, self.quantity - self.quantity_reserved)
+
+    @property
+    def renditions(self):
+        return json.loads(self.trip_img_renditions) if self.trip_img_renditions else {}
+
+    @cached_property
+    def rendition_urls(self):
+        """
+        Purpose: Give the URLs of the image renditions made from the trip's current image
+        Args: None
+        Returns: (dict) rendition name -> URL; empty until the renditions have been generated
+        """
+        renditions = self.renditions
+        if not self.trip_img or renditions.get('source') != self.trip_img.name:
+            return {}
+        return {name: default_storage.url(path) for name, path in renditions.items() if name != 'source'}
+
 
 class Customer(models.Model):
     """
@@ -91,12 +192,22 @@ class Order(models.Model):
     payment_type = models.ForeignKey(PaymentType, on_delete=models.PROTECT, null=True)
     trips = models.ManyToManyField(Trip, through="TripOrder")
     active = models.BooleanField(default=True)
+    # Frozen by checkout.confirm_order; None while the order is still a cart.
+    total = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
 
     def __str__(self):
         return str(self.id)
 
     class Meta:
         ordering = ('order_date',)
+        indexes = [
+            # A customer's order history, oldest first. Open carts have their own partial
+            # unique index, order_open_cart_idx (see migration 0009), which also stops a
+            # customer from having two.
+            models.Index(fields=['customer', 'active', 'order_date'], name='order_customer_history_idx'),
+            # Placed orders by date (order exports walk it in keyset pages, see website/order_export.py).
+            models.Index(fields=['order_date', 'id'], name='order_date_id_idx'),
+        ]
 
 class TripOrder(models.Model):
     """
@@ -106,6 +217,10 @@ class TripOrder(models.Model):
     """   
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
+    # Booking the same trip again raises quantity instead of adding a row (see cart.add_to_cart).
+    quantity = models.PositiveIntegerField(default=1)
+    # The trip's price per seat, frozen by checkout.confirm_order; None while the order is a cart.
+    unit_price = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
 
     def __str__(self):
         return str(self.id)
@@ -113,10 +228,33 @@ class TripOrder(models.Model):
 
     class Meta:
         ordering = ('trip',)
+        unique_together = ('order', 'trip')
 
     def __str__(self):
         return self.trip.title
 
+    @property
+    def line_total(self):
+        return self.trip.price * self.quantity
+
+
+class TripReservation(models.Model):
+    """
+    purpose: Hold seats on a trip for an open order until the order is placed or the hold expires
+    args: Extends the imported Django model class
+    returns: (None): N/A
+    """
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='reservations')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField(default=1)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('order', 'trip')
+
+    def __str__(self):
+        return '{} x {}'.format(self.quantity, self.trip_id)
+
 
 class WishList(models.Model):
     """
@@ -142,12 +280,78 @@ class TripReview(models.Model):
     rating = models.DecimalField(max_digits=2, decimal_places=1, null=False)
     review_text = models.TextField(blank=False, null=False)
 
+    class Meta:
+        indexes = [
+            # A trip's reviews, newest first (keyset ordering ('-id',)).
+            models.Index(fields=['trip', '-id'], name='review_trip_newest_idx'),
+        ]
+
+
+class TripSearchTerm(models.Model):
+    """
+    purpose: Store one posting of the pure-Python trip search index (see website/search.py)
+    args: Extends the imported Django model class
+    returns: (None): N/A
+    """
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE)
+    term = models.CharField(max_length=64, db_index=True)
+    field = models.CharField(max_length=16)
+    frequency = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return self.term
+
+
+class TripRatingBucket(models.Model):
+    """
+    purpose: Store how many reviews of a trip fall in one whole-number rating bucket (e.g. 7 holds 7.0-7.9)
+    args: Extends the imported Django model class
+    returns: (None): N/A
+    """
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='rating_buckets')
+    bucket = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ('-bucket',)
+        unique_together = ('trip', 'bucket')
+
+    def __str__(self):
+        return '{}: {}'.format(self.bucket, self.count)
+
+
+class DailySales(models.Model):
+    """
+    purpose: Seats sold, revenue and orders placed on one day, kept by website.sales so reports never scan orders
+    args: Extends the imported Django model class; abstract, see the per-trip, per-type and per-seller rollups
+    returns: (None): N/A
+    """
+    day = models.DateField()
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+        ordering = ('day',)
 
 
+class DailyTripSales(DailySales):
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='daily_sales')
 
+    class Meta(DailySales.Meta):
+        unique_together = ('day', 'trip')
 
 
+class DailyTripTypeSales(DailySales):
+    trip_type = models.ForeignKey(TripType, on_delete=models.CASCADE, related_name='daily_sales')
 
+    class Meta(DailySales.Meta):
+        unique_together = ('day', 'trip_type')
 
 
+class DailySellerSales(DailySales):
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_sales')
 
+    class Meta(DailySales.Meta):
+        unique_together = ('day', 'seller')
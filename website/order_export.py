@@ -0,0 +1,164 @@
+"""
+Streaming exports of placed orders, for finance.
+
+Every placed order is written with its trip lines, payment type and totals,
+as CSV (one row per line; an order without lines gets one row with the line
+columns empty) or JSON Lines (one object per order, its lines in a list).
+The export_orders command and the staff-only /orders/export view both stream
+export_chunks, which walks the orders in keyset pages of chunk_size
+(website/pagination.py) and loads each page's lines in one more query. Only
+one page is in memory at a time, however many orders match, and a date range
+on order_date narrows the walk through order_date_id_idx.
+
+Reads go to a read replica when there is one: a report can lag a few seconds
+behind without harm, and the primary keeps serving customers.
+
+unit_price and line_total use the price frozen at checkout. Lines of orders
+placed before prices were frozen fall back to the trip's current price.
+"""
+import csv
+import datetime
+import json
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from website.db_routing import use_replica
+from website.models import Order, TripOrder
+from website.pagination import iterate_in_pages
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson; charset=utf-8'}
+
+ORDER_COLUMNS = ('order_id', 'order_date', 'customer', 'payment_type', 'order_total')
+LINE_COLUMNS = ('trip_id', 'trip_title', 'trip_type', 'seller', 'quantity', 'unit_price', 'line_total')
+CSV_COLUMNS = ORDER_COLUMNS + LINE_COLUMNS
+
+ORDERING = ('order_date', 'id')
+
+
+def parse_bound(text):
+    """
+    Purpose: Read one end of an export's date range
+    Args: text -- (str) a date (YYYY-MM-DD, meaning its midnight) or an ISO date and time
+    Returns: (datetime) aware, in the current time zone when text gives none
+    Raises: ValueError when text is neither
+    """
+    try:
+        value = parse_datetime(text)
+        if value is None:
+            day = parse_date(text)
+            value = datetime.datetime.combine(day, datetime.time.min) if day is not None else None
+    except ValueError:
+        value = None
+    if value is None:
+        raise ValueError('{!r} is not a date (YYYY-MM-DD) or date and time'.format(text))
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
+
+
+def placed_orders(start=None, end=None):
+    """
+    Purpose: Select the placed orders in a date range, with what the export shows of them
+    Args: start -- (datetime) earliest order_date included, or None
+        end -- (datetime) order_date the range stops before, or None
+    Returns: (QuerySet) the orders, customer and payment type joined
+    """
+    orders = Order.objects.filter(active=False, order_date__isnull=False)
+    if start is not None:
+        orders = orders.filter(order_date__gte=start)
+    if end is not None:
+        orders = orders.filter(order_date__lt=end)
+    return orders.select_related('customer', 'payment_type')
+
+
+def iterate_orders(start=None, end=None, chunk_size=1000):
+    """
+    Purpose: Walk the placed orders in a date range, oldest first, with their lines
+    Args: start, end -- (datetime) the order_date range, see placed_orders
+        chunk_size -- (integer) orders loaded per query
+    Returns: (generator) (order, list of TripOrder lines) pairs
+    """
+    for page in iterate_in_pages(placed_orders(start, end), ORDERING, chunk_size):
+        lines = {order.pk: [] for order in page}
+        for line in (TripOrder.objects.filter(order__in=list(lines))
+                     .select_related('trip', 'trip__trip_type', 'trip__seller').order_by('order', 'pk')):
+            lines[line.order_id].append(line)
+        for order in page:
+            yield order, lines[order.pk]
+
+
+def _decimal(value):
+    return str(value) if value is not None else ''
+
+
+def order_fields(order):
+    """
+    Purpose: The order columns of an export
+    Args: order -- the placed Order
+    Returns: (list) values in ORDER_COLUMNS order
+    """
+    return [
+        order.pk, order.order_date.isoformat(), order.customer.username,
+        order.payment_type.payment_type_name if order.payment_type is not None else '', _decimal(order.total),
+    ]
+
+
+def line_fields(line):
+    """
+    Purpose: The line columns of an export
+    Args: line -- the TripOrder
+    Returns: (list) values in LINE_COLUMNS order
+    """
+    unit_price = line.unit_price if line.unit_price is not None else line.trip.price
+    return [
+        line.trip_id, line.trip.title, line.trip.trip_type.trip_type_name, line.trip.seller.username,
+        line.quantity, _decimal(unit_price), _decimal(unit_price * line.quantity),
+    ]
+
+
+class _Echo(object):
+    # csv.writer writes each row to this and gets the formatted row back.
+    def write(self, value):
+        return value
+
+
+def csv_chunks(orders):
+    """
+    Purpose: Format orders as CSV, a few rows at a time
+    Args: orders -- (iterable) (order, lines) pairs from iterate_orders
+    Returns: (generator) str chunks, the header row first
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for order, lines in orders:
+        fields = order_fields(order)
+        if not lines:
+            yield writer.writerow(fields + [''] * len(LINE_COLUMNS))
+        else:
+            yield ''.join(writer.writerow(fields + line_fields(line)) for line in lines)
+
+
+def jsonl_chunks(orders):
+    """
+    Purpose: Format orders as JSON Lines, one order per line
+    Args: orders -- (iterable) (order, lines) pairs from iterate_orders
+    Returns: (generator) str chunks
+    """
+    for order, lines in orders:
+        record = dict(zip(ORDER_COLUMNS, order_fields(order)))
+        record['lines'] = [dict(zip(LINE_COLUMNS, line_fields(line))) for line in lines]
+        yield json.dumps(record, sort_keys=True) + '\n'
+
+
+def export_chunks(format_name, start=None, end=None, chunk_size=1000):
+    """
+    Purpose: Export the placed orders in a date range, streamed
+    Args: format_name -- (str) 'csv' or 'jsonl', start, end -- (datetime) the order_date range
+        chunk_size -- (integer) orders loaded per query
+    Returns: (generator) str chunks of the export
+    """
+    formatter = csv_chunks if format_name == 'csv' else jsonl_chunks
+    # Entered here, not by the caller: a streamed response is read after the view has returned.
+    with use_replica():
+        for chunk in formatter(iterate_orders(start, end, chunk_size)):
+            yield chunk
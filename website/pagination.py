@@ -0,0 +1,162 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of OFFSET, each page is fetched with a WHERE clause that starts just
+after the last row of the previous page, so reading page 1,000 costs the same
+as reading page 1. The cursor handed to the client is an opaque, URL-safe
+encoding of the ordering values of that last row.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Integers outside a signed 64-bit column make the database driver raise OverflowError.
+MIN_INTEGER, MAX_INTEGER = -2 ** 63, 2 ** 63 - 1
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    """
+    Purpose: Turn the ordering values of a row into an opaque cursor string
+    Args: values -- (list) the row's values for each ordering field
+    Returns: (str) URL-safe cursor
+    """
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """
+    Purpose: Read the ordering values back out of a cursor made by encode_cursor
+    Args: cursor -- (str) the cursor from the request
+        length -- (integer) the number of ordering fields the cursor must hold
+    Returns: (list) the ordering values
+    Raises: InvalidCursor when the cursor was not produced by encode_cursor for this ordering
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor(cursor)
+    return values
+
+
+def cursor_values(model, ordering, values):
+    """
+    Purpose: Check and convert decoded cursor values to the types of the ordering fields
+    Args: model -- the model being paged through, ordering -- (tuple) field names as passed to order_by()
+        values -- (list) from decode_cursor
+    Returns: (list) the values, converted by each field's to_python()
+    Raises: InvalidCursor when a value is missing or not of its field's type, as in a forged cursor
+    """
+    converted = []
+    for field_name, value in zip(ordering, values):
+        # Cursors made by encode_cursor only hold scalars, and never None: keyset fields are not null.
+        if value is None or isinstance(value, (list, dict)):
+            raise InvalidCursor(value)
+        try:
+            value = model._meta.get_field(field_name.lstrip('-')).to_python(value)
+        except (ValidationError, ValueError, TypeError):
+            raise InvalidCursor(value)
+        if value is None or (isinstance(value, int) and not MIN_INTEGER <= value <= MAX_INTEGER):
+            raise InvalidCursor(value)
+        converted.append(value)
+    return converted
+
+
+def after(ordering, values):
+    """
+    Purpose: Build the filter selecting rows that sort strictly after the given values
+    Args: ordering -- (tuple) field names as passed to order_by(), '-' meaning descending;
+            the last field must be unique
+        values -- (list) the values of those fields for the last row already seen
+    Returns: (Q) e.g. title > t OR (title = t AND id > i) for ('title', 'id')
+    """
+    fields = [field.lstrip('-') for field in ordering]
+    condition = Q()
+    for position, field in enumerate(ordering):
+        equal_prefix = {fields[i]: values[i] for i in range(position)}
+        lookup = '__lt' if field.startswith('-') else '__gt'
+        equal_prefix[fields[position] + lookup] = values[position]
+        condition |= Q(**equal_prefix)
+    return condition
+
+
+class KeysetPage(object):
+    """
+    purpose: One page of results plus the cursor for the page after it
+    args: items -- (list) the rows on this page
+        next_cursor -- (str) cursor for the following page, or None on the last page
+    returns: (None): N/A
+    """
+
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_page(queryset, ordering, cursor=None, page_size=24):
+    """
+    Purpose: Fetch one page of a queryset using keyset pagination
+    Args: queryset -- the rows to page through
+        ordering -- (tuple) field names as passed to order_by(), the last of which must be unique (usually 'id')
+        cursor -- (str) cursor from a previous KeysetPage, or None for the first page
+        page_size -- (integer) maximum number of rows on the page
+    Returns: (KeysetPage) the page
+    Raises: InvalidCursor when the cursor cannot be decoded or holds values of the wrong type
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        values = cursor_values(queryset.model, ordering, decode_cursor(cursor, len(ordering)))
+        queryset = queryset.filter(after(ordering, values))
+
+    # One extra row tells us whether there is a next page without a COUNT query.
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor([_cursor_value(items[-1], field) for field in ordering])
+    return KeysetPage(items, next_cursor)
+
+
+def iterate_in_pages(queryset, ordering, page_size=500):
+    """
+    Purpose: Walk a whole queryset one keyset page at a time so only one page is in memory
+    Args: queryset -- the rows to walk
+        ordering -- (tuple) field names as passed to order_by(), the last of which must be unique
+        page_size -- (integer) rows fetched per query
+    Returns: (generator) yields one list of rows per page
+    """
+    cursor = None
+    while True:
+        page = keyset_page(queryset, ordering, cursor, page_size)
+        if page.items:
+            yield page.items
+        if not page.has_next:
+            return
+        cursor = page.next_cursor
+
+
+def _cursor_value(row, field):
+    value = getattr(row, field.lstrip('-'))
+    # Keep cursors JSON-serializable; the database compares these strings correctly.
+    if not isinstance(value, (int, float, str, bool, type(None))):
+        value = str(value)
+    return value
@@ -0,0 +1,124 @@
+"""
+Denormalized review aggregates.
+
+Every Trip carries rating_count, rating_sum and rating_average, and its
+TripRatingBucket rows hold a per-bucket histogram. The signal receivers in
+website/signals.py call record_review/forget_review as reviews are written so
+the aggregates are adjusted in place with F() updates; recompute_all rebuilds
+them from the TripReview table. The same receivers drop the trip's cached first
+page of reviews (see views.trip_reviews).
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, Value, When
+
+from website.models import Trip, TripRatingBucket, TripReview
+
+
+def first_page_cache_key(trip_id):
+    """
+    Purpose: Name the cache entry holding a trip's rendered first page of reviews
+    Args: trip_id -- (integer) id of the trip
+    Returns: (str) the cache key
+    """
+    return 'trip_reviews:{}:first_page'.format(trip_id)
+
+
+def invalidate_first_page(trip_id):
+    """
+    Purpose: Drop a trip's cached first page of reviews so the next visitor sees fresh reviews
+    Args: trip_id -- (integer) id of the trip
+    Returns: (None): N/A
+    """
+    cache.delete(first_page_cache_key(trip_id))
+
+
+def rating_bucket(rating):
+    """
+    Purpose: Find the histogram bucket a rating belongs to
+    Args: rating -- (Decimal) a review rating such as 7.5
+    Returns: (integer) the whole-number bucket, e.g. 7
+    """
+    return int(Decimal(str(rating)))
+
+
+def _apply(trip_id, rating, direction):
+    rating = Decimal(str(rating))
+    new_count = F('rating_count') + direction
+    new_sum = F('rating_sum') + direction * rating
+
+    with transaction.atomic():
+        Trip.objects.filter(pk=trip_id).update(
+            rating_count=new_count,
+            rating_sum=new_sum,
+            rating_average=Case(
+                When(rating_count=-direction, then=Value(None)),
+                default=ExpressionWrapper(new_sum / new_count, output_field=DecimalField()),
+                output_field=DecimalField(),
+            ),
+        )
+
+        bucket = rating_bucket(rating)
+        buckets = TripRatingBucket.objects.filter(trip_id=trip_id, bucket=bucket)
+        if buckets.update(count=F('count') + direction) or direction < 0:
+            return
+        try:
+            with transaction.atomic():
+                TripRatingBucket.objects.create(trip_id=trip_id, bucket=bucket, count=1)
+        except IntegrityError:
+            # Another request created the bucket first.
+            buckets.update(count=F('count') + 1)
+
+
+def record_review(trip_id, rating):
+    """
+    Purpose: Add a new review's rating to its trip's aggregates
+    Args: trip_id -- (integer) id of the reviewed trip, rating -- the review's rating
+    Returns: (None): N/A
+    """
+    _apply(trip_id, rating, 1)
+
+
+def forget_review(trip_id, rating):
+    """
+    Purpose: Take a deleted (or replaced) review's rating back out of its trip's aggregates
+    Args: trip_id -- (integer) id of the reviewed trip, rating -- the review's rating
+    Returns: (None): N/A
+    """
+    _apply(trip_id, rating, -1)
+
+
+def recompute_all():
+    """
+    Purpose: Rebuild every trip's review aggregates and histogram from the TripReview table
+    Args: None
+    Returns: (integer) number of trips that have at least one review
+    """
+    counts = defaultdict(int)
+    sums = defaultdict(Decimal)
+    histograms = defaultdict(lambda: defaultdict(int))
+    for trip_id, rating in TripReview.objects.values_list('trip_id', 'rating').iterator():
+        counts[trip_id] += 1
+        sums[trip_id] += rating
+        histograms[trip_id][rating_bucket(rating)] += 1
+
+    with transaction.atomic():
+        Trip.objects.update(rating_count=0, rating_sum=0, rating_average=None)
+        for trip_id, count in counts.items():
+            Trip.objects.filter(pk=trip_id).update(
+                rating_count=count,
+                rating_sum=sums[trip_id],
+                rating_average=sums[trip_id] / count,
+            )
+
+        TripRatingBucket.objects.all().delete()
+        TripRatingBucket.objects.bulk_create(
+            TripRatingBucket(trip_id=trip_id, bucket=bucket, count=count)
+            for trip_id, histogram in histograms.items()
+            for bucket, count in histogram.items()
+        )
+
+    return len(counts)
@@ -0,0 +1,159 @@
+"""
+Daily sales rollups.
+
+DailyTripSales, DailyTripTypeSales and DailySellerSales hold, per day (in
+TIME_ZONE) and per trip, trip type or seller, the seats sold, the revenue
+(unit prices frozen at checkout times seats) and the number of orders. Sales
+reports and the staff dashboard read only these tables, so their cost grows
+with the number of days and trips shown, not with the number of orders.
+
+checkout.confirm_order calls record_order in the transaction that places the
+order, so the rollups move with the orders. The order's lines are totalled in
+SQL: an INSERT ... SELECT creates the day's missing rows at zero and an
+UPDATE adds the order to all of them, two statements per rollup however large
+the order is. The rebuild_sales_rollups command (rebuild_all) recomputes
+everything from the placed orders, e.g. after orders were changed outside
+checkout.
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from website.models import DailySellerSales, DailyTripSales, DailyTripTypeSales, Trip, TripOrder
+
+# (rollup model, its key column, the Trip column holding the same key)
+ROLLUPS = (
+    (DailyTripSales, 'trip_id', 'id'),
+    (DailyTripTypeSales, 'trip_type_id', 'trip_type_id'),
+    (DailySellerSales, 'seller_id', 'seller_id'),
+)
+
+# The lines of one order, with their trips.
+ORDER_LINES = '{lines} l JOIN {trips} t ON t.id = l.trip_id WHERE l.order_id = %s'.format(
+    lines=TripOrder._meta.db_table, trips=Trip._meta.db_table)
+
+# Creates, at zero, the day's rows the order needs and the day does not have yet.
+# Creating nothing but zeros is what makes it safe to run again after a conflict.
+INSERT_SQL = """
+    INSERT INTO {rollup} (day, units, revenue, orders, {key})
+    SELECT DISTINCT %s, 0, 0, 0, t.{column} FROM {lines}
+        AND NOT EXISTS (SELECT 1 FROM {rollup} r WHERE r.day = %s AND r.{key} = t.{column})
+"""
+
+# Adds the order to the day's rows; the subqueries total its lines per key.
+UPDATE_SQL = """
+    UPDATE {rollup} SET
+        units = units + (SELECT SUM(l.quantity) FROM {lines} AND t.{column} = {rollup}.{key}),
+        revenue = revenue + (SELECT SUM(l.unit_price * l.quantity) FROM {lines} AND t.{column} = {rollup}.{key}),
+        orders = orders + 1
+    WHERE day = %s AND {key} IN (SELECT t.{column} FROM {lines})
+"""
+
+
+def sales_day(moment):
+    """
+    Purpose: Tell which day's rollups an order placed at a moment counts in
+    Args: moment -- (datetime) the order_date
+    Returns: (date) the day in TIME_ZONE
+    """
+    return timezone.localdate(moment)
+
+
+def _create_missing_rows(cursor, names, order_id, day):
+    with transaction.atomic():
+        cursor.execute(INSERT_SQL.format(**names), [day, order_id, day])
+
+
+def _add(model, key, column, order_id, day):
+    names = {'rollup': model._meta.db_table, 'key': key, 'column': column, 'lines': ORDER_LINES}
+    with connection.cursor() as cursor:
+        while True:
+            try:
+                _create_missing_rows(cursor, names, order_id, day)
+                break
+            except IntegrityError:
+                # An order placed at the same moment created some of the rows first; the
+                # next attempt skips those. Nothing has been added to any row yet.
+                pass
+        cursor.execute(UPDATE_SQL.format(**names), [order_id, order_id, day, order_id])
+
+
+def record_order(order):
+    """
+    Purpose: Add a just-placed order to the day's rollups; call in the transaction that places it
+    Args: order -- the Order, with order_date set and line unit prices frozen
+    Returns: (None): N/A
+    """
+    # Two statements per rollup, however many lines the order has.
+    day = connection.ops.adapt_datefield_value(sales_day(order.order_date))
+    for model, key, column in ROLLUPS:
+        _add(model, key, column, order.pk, day)
+
+
+def rebuild_all():
+    """
+    Purpose: Recompute every rollup from the placed orders
+    Args: None
+    Returns: (dict) rollup model name -> number of rows written
+    """
+    # The lines are read in the same transaction that rewrites the rollups, so an order
+    # placed in between cannot be left out of them (with SQLITE_IMMEDIATE_TRANSACTIONS the
+    # transaction starts with BEGIN IMMEDIATE and checkouts wait for it).
+    with transaction.atomic():
+        lines = (TripOrder.objects
+                 .filter(order__active=False, order__order_date__isnull=False)
+                 # Lines placed before prices were frozen count at the trip's current price.
+                 .annotate(price=Coalesce('unit_price', 'trip__price'))
+                 .order_by('order_id')
+                 .values_list('order__order_date', 'order_id', 'quantity', 'price',
+                              *['trip__' + column for model, key, column in ROLLUPS]))
+
+        totals = [{} for rollup in ROLLUPS]
+        for line in lines.iterator():
+            order_date, order_id, quantity, price = line[:4]
+            day = sales_day(order_date)
+            for rollup_totals, key in zip(totals, line[4:]):
+                # [units, revenue, orders, last order counted]; lines arrive grouped by order.
+                row = rollup_totals.setdefault((day, key), [0, Decimal('0.00'), 0, None])
+                row[0] += quantity
+                row[1] += price * quantity
+                if row[3] != order_id:
+                    row[2] += 1
+                    row[3] = order_id
+
+        written = {}
+        for (model, key_field, column), rollup_totals in zip(ROLLUPS, totals):
+            model.objects.all().delete()
+            model.objects.bulk_create([
+                model(day=day, units=units, revenue=revenue, orders=orders, **{key_field: key})
+                for (day, key), (units, revenue, orders, last_order) in sorted(rollup_totals.items())],
+                batch_size=500)
+            written[model.__name__] = len(rollup_totals)
+    return written
+
+
+def daily_totals(start, end):
+    """
+    Purpose: Seats sold and revenue per day, from the trip type rollup
+    Args: start, end -- (date) the first and last day included
+    Returns: (list) dicts with day, units and revenue, oldest day first; days without sales are left out
+    """
+    return list(DailyTripTypeSales.objects.filter(day__gte=start, day__lte=end)
+                .values('day').annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('day'))
+
+
+def ranking(model, name_field, start, end, limit=10):
+    """
+    Purpose: Rank the trips, trip types or sellers of a rollup by revenue over a range of days
+    Args: model -- a rollup model, name_field -- (str) lookup of the name to show, e.g. 'trip__title'
+        start, end -- (date) the first and last day included, limit -- (integer) rows to return
+    Returns: (list) dicts with the rollup's key, name, units, revenue and orders, highest revenue first
+    """
+    key = next(key for rollup, key, column in ROLLUPS if rollup is model)
+    return list(model.objects.filter(day__gte=start, day__lte=end)
+                .values(key, name=F(name_field))
+                .annotate(units=Sum('units'), revenue=Sum('revenue'), orders=Sum('orders'))
+                .order_by('-revenue', 'name')[:limit])
@@ -0,0 +1,265 @@
+"""
+Full-text search over the trip catalog.
+
+Trips are indexed on their title, location and description. The default
+backend is a SQLite FTS5 virtual table; when the database is not SQLite (or
+SQLite was built without FTS5) a pure-Python inverted index stored in the
+TripSearchTerm table is used instead. Both backends tokenize the same way,
+match every query word as a prefix and rank results by relevance, with
+title hits weighted above location hits and location hits above description
+hits.
+
+Whether a database has the FTS5 table is looked up once per database alias
+and remembered until migrations run or the index is rebuilt. Searches use the
+alias Trip reads are routed to (a replica, when there is one); index writes
+use the alias Trip writes go to.
+"""
+import math
+import re
+from collections import Counter, OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import Q
+
+from website.models import Trip, TripSearchTerm
+
+FTS_TABLE = 'website_trip_fts'
+
+# Order matters: it is the column order of the FTS5 table and of bm25() weights.
+INDEXED_FIELDS = ('title', 'location', 'description')
+FIELD_WEIGHTS = {'title': 3.0, 'location': 2.0, 'description': 1.0}
+
+MAX_TERM_LENGTH = 64
+DEFAULT_RESULT_LIMIT = 100
+# Trips indexed per DELETE ... IN and multi-row insert.
+INDEX_BATCH_SIZE = 500
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """
+    Purpose: Split free text into lowercase index terms
+    Args: text -- (str) the text to tokenize, may be None
+    Returns: (list) the terms in the order they appear
+    """
+    if not text:
+        return []
+    return [token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text.lower())]
+
+
+# Database alias -> whether it has the FTS5 table, so sqlite_master is read once per alias.
+_fts5_tables = {}
+
+
+def fts5_table_exists(using=DEFAULT_DB_ALIAS):
+    """
+    Purpose: Check whether the FTS5 index table exists on a database, asking it once per alias
+    Args: using -- (str) the database alias
+    Returns: (bool) True when the SQLite FTS5 backend can be used
+    """
+    if using not in _fts5_tables:
+        db = connections[using]
+        exists = False
+        if db.vendor == 'sqlite':
+            with db.cursor() as cursor:
+                cursor.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                exists = cursor.fetchone() is not None
+        _fts5_tables[using] = exists
+    return _fts5_tables[using]
+
+
+def forget_fts5_tables():
+    """
+    Purpose: Make fts5_table_exists ask the databases again, after migrations created or dropped the table
+    Args: None
+    Returns: (None): N/A
+    """
+    _fts5_tables.clear()
+
+
+class FTS5Backend(object):
+    """
+    purpose: Keeps trips in a SQLite FTS5 virtual table and ranks matches with bm25()
+    args: None
+    returns: (None): N/A
+    """
+    name = 'fts5'
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+
+    def index_trips(self, trips):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute("DELETE FROM {} WHERE rowid IN ({})".format(FTS_TABLE, ', '.join(['%s'] * len(trips))),
+                           [trip.pk for trip in trips])
+            cursor.executemany(
+                "INSERT INTO {} (rowid, title, location, description) VALUES (%s, %s, %s, %s)".format(FTS_TABLE),
+                [[trip.pk, trip.title, trip.location, trip.description] for trip in trips])
+
+    def remove_trip(self, trip_id):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute("DELETE FROM {} WHERE rowid = %s".format(FTS_TABLE), [trip_id])
+
+    def clear(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute("DELETE FROM {}".format(FTS_TABLE))
+
+    def search(self, terms, limit):
+        # Every term is quoted, so user input can never be read as FTS5 query syntax.
+        match = ' '.join('"{}"*'.format(term) for term in terms)
+        weights = ', '.join(str(FIELD_WEIGHTS[field]) for field in INDEXED_FIELDS)
+        # get_backend was given the database (primary or replica) the Trip rows will be loaded from.
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                "SELECT rowid FROM {table} WHERE {table} MATCH %s "
+                "ORDER BY bm25({table}, {weights}) LIMIT %s".format(table=FTS_TABLE, weights=weights),
+                [match, limit])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PythonBackend(object):
+    """
+    purpose: Keeps an inverted index of trips in the TripSearchTerm table and ranks in Python
+    args: None
+    returns: (None): N/A
+    """
+    name = 'python'
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+
+    def index_trips(self, trips):
+        entries = []
+        for trip in trips:
+            for field in INDEXED_FIELDS:
+                for term, frequency in Counter(tokenize(getattr(trip, field))).items():
+                    entries.append(TripSearchTerm(trip_id=trip.pk, term=term, field=field, frequency=frequency))
+
+        with transaction.atomic(using=self.using):
+            TripSearchTerm.objects.using(self.using).filter(trip_id__in=[trip.pk for trip in trips]).delete()
+            TripSearchTerm.objects.using(self.using).bulk_create(entries)
+
+    def remove_trip(self, trip_id):
+        TripSearchTerm.objects.using(self.using).filter(trip_id=trip_id).delete()
+
+    def clear(self):
+        TripSearchTerm.objects.using(self.using).all().delete()
+
+    def search(self, terms, limit):
+        prefix_match = Q()
+        for term in terms:
+            prefix_match |= Q(term__startswith=term)
+        postings = TripSearchTerm.objects.using(self.using).filter(prefix_match).values_list(
+            'trip_id', 'term', 'field', 'frequency')
+
+        # scores[trip_id][query term] -> weighted frequency of every index term it prefixes
+        scores = defaultdict(lambda: defaultdict(float))
+        for trip_id, indexed_term, field, frequency in postings:
+            for term in terms:
+                if indexed_term.startswith(term):
+                    scores[trip_id][term] += FIELD_WEIGHTS[field] * frequency
+
+        # Every query term has to match, the same as FTS5's implicit AND.
+        matches = {trip_id: hits for trip_id, hits in scores.items() if len(hits) == len(terms)}
+        if not matches:
+            return []
+
+        total = Trip.objects.using(self.using).count()
+        document_frequency = Counter(term for hits in matches.values() for term in hits)
+        ranked = sorted(
+            matches.items(),
+            key=lambda item: (
+                -sum(weight * math.log(1 + total / document_frequency[term]) for term, weight in item[1].items()),
+                item[0]),
+        )
+        return [trip_id for trip_id, hits in ranked[:limit]]
+
+
+def get_backend(using=None):
+    """
+    Purpose: Pick the search backend named by the TRIP_SEARCH_BACKEND setting for a database
+    Args: using -- (str) the database alias; by default the one trips are written to
+    Returns: an FTS5Backend, or a PythonBackend when FTS5 is not configured or not available there
+    """
+    if using is None:
+        using = router.db_for_write(Trip)
+    if getattr(settings, 'TRIP_SEARCH_BACKEND', 'fts5') == 'fts5' and fts5_table_exists(using):
+        return FTS5Backend(using)
+    return PythonBackend(using)
+
+
+def index_trip(trip):
+    """
+    Purpose: Add a trip to the search index, replacing any previous entry for it
+    Args: trip -- the saved Trip instance
+    Returns: (None): N/A
+    """
+    index_trips([trip])
+
+
+def index_trips(trips):
+    """
+    Purpose: Add trips to the search index, replacing any previous entries for them, in a fixed number of queries
+    Args: trips -- (list) saved Trip instances
+    Returns: (None): N/A
+    """
+    backend = get_backend()
+    # Batched to stay under SQLite's limit on query parameters.
+    for start in range(0, len(trips), INDEX_BATCH_SIZE):
+        backend.index_trips(trips[start:start + INDEX_BATCH_SIZE])
+
+
+def remove_trip(trip_id):
+    """
+    Purpose: Drop a trip from the search index
+    Args: trip_id -- (integer) id of the deleted trip
+    Returns: (None): N/A
+    """
+    get_backend().remove_trip(trip_id)
+
+
+def rebuild_index():
+    """
+    Purpose: Empty the search index and re-index every trip
+    Args: None
+    Returns: (integer) number of trips indexed
+    """
+    # Also the way to pick up an FTS5 table created or dropped by hand.
+    forget_fts5_tables()
+    backend = get_backend()
+    indexed = 0
+    with transaction.atomic(using=backend.using):
+        backend.clear()
+        batch = []
+        for trip in Trip.objects.using(backend.using).only(*INDEXED_FIELDS).order_by('pk').iterator():
+            batch.append(trip)
+            if len(batch) == INDEX_BATCH_SIZE:
+                backend.index_trips(batch)
+                indexed, batch = indexed + len(batch), []
+        if batch:
+            backend.index_trips(batch)
+            indexed += len(batch)
+    return indexed
+
+
+def search_trips(query, limit=None):
+    """
+    Purpose: Find the trips matching a free-text query, most relevant first
+    Args: query -- (str) what the user typed in the search bar
+        limit -- (integer) maximum number of trips to return
+    Returns: (list) matching Trip instances ordered by relevance
+    """
+    terms = list(OrderedDict.fromkeys(tokenize(query)))
+    if not terms:
+        return []
+    if limit is None:
+        limit = getattr(settings, 'TRIP_SEARCH_RESULT_LIMIT', DEFAULT_RESULT_LIMIT)
+
+    # Searches the database (primary or replica) the Trip rows will be loaded from.
+    using = router.db_for_read(Trip)
+    trip_ids = get_backend(using).search(terms, limit)
+    trips = Trip.objects.using(using).in_bulk(trip_ids)
+    return [trips[trip_id] for trip_id in trip_ids if trip_id in trips]
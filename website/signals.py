@@ -0,0 +1,133 @@
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from website import catalog_cache, images, inventory, reviews, search
+from website.models import Order, Trip, TripReservation, TripReview, TripType
+
+
+@receiver(post_save, sender=Trip)
+def index_saved_trip(sender, instance, **kwargs):
+    """
+    Purpose: Keep the search index and cached review pages in step with a created or edited trip
+    Args: instance -- the Trip that was saved
+    Returns: (None): N/A
+    """
+    search.index_trip(instance)
+    # Review pages show the trip's title.
+    reviews.invalidate_first_page(instance.pk)
+
+
+@receiver(post_save, sender=Trip)
+def make_image_renditions(sender, instance, raw=False, **kwargs):
+    """
+    Purpose: Queue the image renditions of a trip whose image was uploaded or replaced
+    Args: instance -- the Trip that was saved, raw -- True while loading fixtures
+    Returns: (None): N/A
+    """
+    # Fixtures may name images that are not in storage yet; backfill those with
+    # the generate_trip_renditions command.
+    if not raw and images.needs_renditions(instance):
+        images.schedule_renditions(instance)
+
+
+@receiver(post_delete, sender=Trip)
+def unindex_deleted_trip(sender, instance, **kwargs):
+    """
+    Purpose: Remove a deleted trip from the search index
+    Args: instance -- the Trip that was deleted
+    Returns: (None): N/A
+    """
+    search.remove_trip(instance.pk)
+
+
+@receiver(post_migrate)
+def forget_search_tables(sender, **kwargs):
+    """
+    Purpose: Make the search backend look for the FTS5 table again once migrations may have created or dropped it
+    Args: sender -- the app config whose migrations ran
+    Returns: (None): N/A
+    """
+    search.forget_fts5_tables()
+
+
+@receiver(pre_save, sender=TripReview)
+def remember_previous_rating(sender, instance, **kwargs):
+    """
+    Purpose: Note what an edited review used to say so its old rating can be taken out of the aggregates
+    Args: instance -- the TripReview about to be saved
+    Returns: (None): N/A
+    """
+    instance._previous_rating = None
+    if instance.pk is not None:
+        instance._previous_rating = TripReview.objects.filter(pk=instance.pk).values_list('trip_id', 'rating').first()
+
+
+@receiver(post_save, sender=TripReview)
+def add_review_to_aggregates(sender, instance, **kwargs):
+    """
+    Purpose: Count a created or edited review in its trip's rating aggregates and refresh its review page
+    Args: instance -- the TripReview that was saved
+    Returns: (None): N/A
+    """
+    previous = getattr(instance, '_previous_rating', None)
+    if previous is not None:
+        reviews.forget_review(*previous)
+        reviews.invalidate_first_page(previous[0])
+    reviews.record_review(instance.trip_id, instance.rating)
+    reviews.invalidate_first_page(instance.trip_id)
+
+
+@receiver(post_delete, sender=TripReview)
+def remove_review_from_aggregates(sender, instance, **kwargs):
+    """
+    Purpose: Take a deleted review out of its trip's rating aggregates and refresh its review page
+    Args: instance -- the TripReview that was deleted
+    Returns: (None): N/A
+    """
+    reviews.forget_review(instance.trip_id, instance.rating)
+    reviews.invalidate_first_page(instance.trip_id)
+
+
+@receiver(pre_delete, sender=Order)
+def release_order_holds(sender, instance, **kwargs):
+    """
+    Purpose: Give the seats a cancelled or deleted order holds back to their trips before its holds cascade away
+    Args: instance -- the Order about to be deleted
+    Returns: (None): N/A
+    """
+    inventory.delete_holds(TripReservation.objects.filter(order=instance))
+
+
+@receiver(post_save, sender=Trip)
+@receiver(post_delete, sender=Trip)
+def invalidate_cached_trip(sender, instance, **kwargs):
+    """
+    Purpose: Stop serving cached catalog pages and cards that show a created, edited or deleted trip
+    Args: instance -- the Trip that was saved or deleted
+    Returns: (None): N/A
+    """
+    catalog_cache.bump('catalog', catalog_cache.trip_scope(instance.pk))
+
+
+@receiver(post_save, sender=TripType)
+@receiver(post_delete, sender=TripType)
+def invalidate_cached_trip_types(sender, instance, **kwargs):
+    """
+    Purpose: Stop serving cached catalog pages that show a created, renamed or deleted trip type
+    Args: instance -- the TripType that was saved or deleted
+    Returns: (None): N/A
+    """
+    catalog_cache.bump('catalog', 'trip_types')
+
+
+@receiver(post_save, sender=TripReview)
+@receiver(post_delete, sender=TripReview)
+def invalidate_cached_ratings(sender, instance, **kwargs):
+    """
+    Purpose: Stop serving cached catalog pages and cards with a trip's old rating
+    Args: instance -- the TripReview that was saved or deleted
+    Returns: (None): N/A
+    """
+    previous = getattr(instance, '_previous_rating', None)
+    trip_ids = {instance.trip_id} | ({previous[0]} if previous else set())
+    catalog_cache.bump('catalog', *[catalog_cache.trip_scope(trip_id) for trip_id in trip_ids])
@@ -0,0 +1,46 @@
+from django import template
+from django.conf import settings
+
+from website import catalog_cache
+
+register = template.Library()
+
+
+class TripCardCacheNode(template.Node):
+    def __init__(self, nodelist, trip, name):
+        self.nodelist = nodelist
+        self.trip = trip
+        self.name = name
+
+    def render(self, context):
+        trip = self.trip.resolve(context)
+        name = self.name.resolve(context)
+        version = getattr(trip, 'catalog_version', None)
+        if version is None:
+            scope = catalog_cache.trip_scope(trip.pk)
+            version = catalog_cache.versions([scope])[scope]
+
+        key = 'catalog:fragment:{}:{}:{}'.format(name, trip.pk, version)
+        cache = catalog_cache.get_cache()
+        html = cache.get(key)
+        catalog_cache.record('fragment:{}'.format(name), html is not None)
+        if html is None:
+            html = self.nodelist.render(context)
+            cache.set(key, html, settings.CATALOG_FRAGMENT_CACHE_TIMEOUT)
+        return html
+
+
+@register.tag
+def trip_card_cache(parser, token):
+    """
+    Purpose: Cache the rendered markup of one trip's card until the trip changes
+    Args: {% trip_card_cache trip "name" %} ... {% endtrip_card_cache %}, where name tells
+        apart the card layouts of different pages
+    Returns: (TripCardCacheNode) the template node
+    """
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError('{} takes a trip and a fragment name'.format(bits[0]))
+    nodelist = parser.parse(('endtrip_card_cache',))
+    parser.delete_first_token()
+    return TripCardCacheNode(nodelist, parser.compile_filter(bits[1]), parser.compile_filter(bits[2]))
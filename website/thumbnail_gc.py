@@ -0,0 +1,206 @@
+"""
+Garbage collection for generated images.
+
+sorl-thumbnail writes thumbnails to media/cache/xx/yy/<hash>.<ext> and
+website/images.py writes renditions to media/renditions/. Neither ever removes
+anything, so files for deleted trips, replaced images and geometries the
+templates no longer ask for pile up. collect_garbage walks both trees with
+os.scandir, one directory at a time, and:
+
+* deletes every file that no current trip image would produce (orphans), as
+  long as it is older than min_age -- a file may be written a moment before
+  the database row that refers to it;
+* optionally caps media/cache at max_bytes by deleting the least recently
+  used thumbnails, by access time (or modification time where the filesystem
+  does not keep access times). This takes a second pass: the first builds a
+  per-hour histogram of bytes by last use, which tells the second pass which
+  files to delete without ever holding the list of files in memory;
+* removes directories left empty.
+
+Deleted thumbnails are dropped from the thumbnail key-value store as well, so
+sorl regenerates them the next time a template asks. Run it from cron with the
+gc_thumbnails management command.
+"""
+import json
+import os
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from sorl.thumbnail.conf import settings as sorl_settings
+
+from website.models import Trip
+from website.thumbnails import TRIP_THUMBNAILS, forget_thumbnail, thumbnail_name
+
+RENDITIONS_DIRECTORY = 'renditions'
+
+_BUCKET_SECONDS = 60 * 60
+
+
+def walk_files(root):
+    """
+    Purpose: Stream every regular file under a directory without listing the whole tree first
+    Args: root -- (str) absolute directory to walk; a missing directory yields nothing
+    Returns: (generator) yields (path, os.stat_result) pairs
+    """
+    try:
+        entries = os.scandir(root)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry.path, entry.stat(follow_symlinks=False)
+
+
+def remove_empty_directories(root):
+    """
+    Purpose: Delete the directories under root that have no files left in them
+    Args: root -- (str) absolute directory to tidy; root itself is kept
+    Returns: (integer) number of directories removed
+    """
+    removed = 0
+    for directory, subdirectories, files in os.walk(root, topdown=False):
+        if directory != root and not os.listdir(directory):
+            os.rmdir(directory)
+            removed += 1
+    return removed
+
+
+def last_used(stat):
+    """
+    Purpose: Tell when a file was last read, as well as the filesystem records it
+    Args: stat -- (os.stat_result) the file's stat
+    Returns: (float) timestamp; never earlier than the file's modification time
+    """
+    # With noatime/relatime mounts the access time can be older than the write.
+    return max(stat.st_atime, stat.st_mtime)
+
+
+def live_files():
+    """
+    Purpose: Collect the storage names of every thumbnail and rendition current trips use
+    Args: None
+    Returns: (set) storage names relative to MEDIA_ROOT
+    """
+    live = set()
+    trips = Trip.objects.exclude(trip_img='').exclude(trip_img__isnull=True)
+    for trip in trips.only('pk', 'trip_img', 'trip_img_renditions').iterator():
+        for geometry, options in TRIP_THUMBNAILS:
+            live.add(thumbnail_name(trip.trip_img, geometry, options))
+        renditions = json.loads(trip.trip_img_renditions or '{}')
+        if renditions.get('source') == trip.trip_img.name:
+            live.update(path for name, path in renditions.items() if name != 'source')
+    return live
+
+
+class GarbageCollector(object):
+    """
+    purpose: One run over the generated image trees; see the module docstring
+    args: max_bytes -- (integer) size cap for the thumbnail cache, or None for no cap
+        min_age -- (integer) seconds a file must have existed before it can count as an orphan
+        dry_run -- (bool) report what would be deleted without deleting anything
+    returns: (None): N/A
+    """
+
+    def __init__(self, max_bytes=None, min_age=3600, dry_run=False):
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.dry_run = dry_run
+        self.media_root = settings.MEDIA_ROOT
+        self.cache_root = os.path.join(self.media_root, sorl_settings.THUMBNAIL_PREFIX.strip('/'))
+        self.roots = [self.cache_root, os.path.join(self.media_root, RENDITIONS_DIRECTORY)]
+        self.report = {
+            'scanned': 0, 'scanned_bytes': 0,
+            'orphans': 0, 'orphan_bytes': 0,
+            'evicted': 0, 'evicted_bytes': 0,
+            'cache_bytes': 0, 'directories': 0,
+        }
+
+    def run(self):
+        """
+        Purpose: Delete orphans, enforce the size cap and tidy empty directories
+        Args: None
+        Returns: (dict) counts and byte totals of what was scanned, deleted and kept
+        """
+        self.live = live_files()
+        self.now = time.time()
+
+        # Bytes of surviving thumbnails per hour of last use, oldest first once sorted.
+        histogram = defaultdict(int)
+        for root in self.roots:
+            for path, stat in walk_files(root):
+                self.report['scanned'] += 1
+                self.report['scanned_bytes'] += stat.st_size
+                if self._is_orphan(path, stat):
+                    self._delete(path)
+                    self.report['orphans'] += 1
+                    self.report['orphan_bytes'] += stat.st_size
+                elif root == self.cache_root:
+                    self.report['cache_bytes'] += stat.st_size
+                    histogram[self._bucket(stat)] += stat.st_size
+
+        if self.max_bytes is not None and self.report['cache_bytes'] > self.max_bytes:
+            self._evict(histogram, self.report['cache_bytes'] - self.max_bytes)
+
+        if not self.dry_run:
+            for root in self.roots:
+                if os.path.isdir(root):
+                    self.report['directories'] += remove_empty_directories(root)
+        return self.report
+
+    def _name(self, path):
+        return os.path.relpath(path, self.media_root).replace(os.sep, '/')
+
+    def _bucket(self, stat):
+        return int(last_used(stat) // _BUCKET_SECONDS)
+
+    def _is_orphan(self, path, stat):
+        return self._name(path) not in self.live and self.now - stat.st_mtime >= self.min_age
+
+    def _evict(self, histogram, excess):
+        # Everything last used before the cutoff hour goes; of the cutoff hour itself,
+        # only as many bytes as it takes to get under the cap.
+        cutoff_budget = excess
+        for cutoff in sorted(histogram):
+            if histogram[cutoff] >= cutoff_budget:
+                break
+            cutoff_budget -= histogram[cutoff]
+
+        for path, stat in walk_files(self.cache_root):
+            bucket = self._bucket(stat)
+            # In a dry run the orphans found by the first pass are still on disk.
+            if bucket > cutoff or self._is_orphan(path, stat):
+                continue
+            if bucket == cutoff:
+                if cutoff_budget <= 0:
+                    continue
+                cutoff_budget -= stat.st_size
+            self._delete(path)
+            self.report['evicted'] += 1
+            self.report['evicted_bytes'] += stat.st_size
+            self.report['cache_bytes'] -= stat.st_size
+
+    def _delete(self, path):
+        if self.dry_run:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        if path.startswith(self.cache_root + os.sep):
+            forget_thumbnail(self._name(path))
+
+
+def collect_garbage(max_bytes=None, min_age=3600, dry_run=False):
+    """
+    Purpose: Remove orphaned thumbnails and renditions and keep the thumbnail cache under a size cap
+    Args: max_bytes -- (integer) size cap for media/cache, or None for no cap
+        min_age -- (integer) seconds a file must have existed before it can count as an orphan
+        dry_run -- (bool) only report what would be deleted
+    Returns: (dict) scanned/scanned_bytes, orphans/orphan_bytes, evicted/evicted_bytes,
+        cache_bytes (the cache size afterwards) and directories removed
+    """
+    return GarbageCollector(max_bytes, min_age, dry_run).run()
@@ -0,0 +1,212 @@
+"""
+Thumbnail metadata store.
+
+sorl-thumbnail looks up every {% thumbnail %} in its key-value store before it
+touches storage. The stock store reads the shared cache and, on a miss, the
+thumbnail_kvstore table. KVStore below puts a size-bounded, in-process LRU in
+front of both, so a page rendered by a warm worker costs no cache round trip,
+no query and no storage exists() check. Entries in the LRU live at most
+THUMBNAIL_LOCAL_CACHE_TIMEOUT seconds so a thumbnail deleted by another
+process is not served for long. Select it with THUMBNAIL_KVSTORE; fill it
+with the warm_thumbnails management command.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults, settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore as CachedDBKVStore
+
+# Geometries the templates ask sorl for; warm_thumbnails pre-generates each of them.
+TRIP_THUMBNAILS = [
+    ('1150x400', {'crop': 'center'}),
+]
+
+
+class LRUCache(object):
+    """
+    purpose: A thread-safe least-recently-used mapping bounded by entry count and total value size
+    args: max_entries -- (integer) most entries kept
+        max_bytes -- (integer) most characters of values kept, summed over entries
+        timeout -- (integer) seconds an entry stays valid, or None to keep it until evicted
+    returns: (None): N/A
+    """
+
+    def __init__(self, max_entries, max_bytes, timeout=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        size = len(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            expires = time.monotonic() + self.timeout if self.timeout is not None else None
+            self._entries[key] = (value, expires)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def stats(self):
+        """
+        Purpose: Report how well the cache is doing
+        Args: None
+        Returns: (dict) hits, misses, hit_ratio, evictions, entries, bytes and the limits
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+
+class KVStore(CachedDBKVStore):
+    """
+    purpose: sorl-thumbnail key-value store: in-process LRU, then the shared cache, then the database
+    args: None
+    returns: (None): N/A
+    """
+
+    def __init__(self):
+        super(KVStore, self).__init__()
+        self.local = LRUCache(
+            settings.THUMBNAIL_LOCAL_CACHE_MAX_ENTRIES,
+            settings.THUMBNAIL_LOCAL_CACHE_MAX_BYTES,
+            settings.THUMBNAIL_LOCAL_CACHE_TIMEOUT,
+        )
+
+    def clear(self, delete_thumbnails=False):
+        super(KVStore, self).clear(delete_thumbnails)
+        self.local.clear()
+
+    def _get_raw(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        value = super(KVStore, self)._get_raw(key)
+        # Misses are not kept: another worker may create the thumbnail any moment.
+        if value is not None:
+            self.local.set(key, value)
+        return value
+
+    def _set_raw(self, key, value):
+        super(KVStore, self)._set_raw(key, value)
+        self.local.set(key, value)
+
+    def _delete_raw(self, *keys):
+        super(KVStore, self)._delete_raw(*keys)
+        for key in keys:
+            self.local.delete(key)
+
+
+def kvstore_stats():
+    """
+    Purpose: Read this process's thumbnail store hit/miss counters
+    Args: None
+    Returns: (dict) the in-process LRU stats, or None when THUMBNAIL_KVSTORE is another store
+    """
+    local = getattr(default.kvstore, 'local', None)
+    return local.stats() if isinstance(local, LRUCache) else None
+
+
+def warm_trip_thumbnails(trips):
+    """
+    Purpose: Generate every template thumbnail of the given trips and record them in the store
+    Args: trips -- iterable of Trips
+    Returns: (tuple) (number of images warmed, list of (trip, error) for images that failed)
+    """
+    warmed = 0
+    failed = []
+    for trip in trips:
+        if not trip.trip_img:
+            continue
+        try:
+            for geometry, options in TRIP_THUMBNAILS:
+                get_thumbnail(trip.trip_img, geometry, **options)
+            warmed += 1
+        except Exception as error:
+            failed.append((trip, error))
+    return warmed, failed
+
+
+def thumbnail_name(image, geometry, options):
+    """
+    Purpose: Work out the storage name sorl-thumbnail gives a thumbnail, without generating it
+    Args: image -- the source image (e.g. trip.trip_img)
+        geometry -- (str) geometry string such as '1150x400'
+        options -- (dict) thumbnail options such as {'crop': 'center'}
+    Returns: (str) the name get_thumbnail() would use, e.g. 'cache/ab/cd/abcd....jpg'
+    """
+    # Mirrors the option defaults sorl's ThumbnailBackend.get_thumbnail applies before naming.
+    backend = default.backend
+    source = ImageFile(image)
+    options = dict(options)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    return backend._get_thumbnail_filename(source, geometry, options)
+
+
+def forget_thumbnail(name):
+    """
+    Purpose: Drop a thumbnail's entry from the key-value store so sorl regenerates it next time
+    Args: name -- (str) storage name of the thumbnail file
+    Returns: (None): N/A
+    """
+    default.kvstore.delete(ImageFile(name, default.storage), delete_thumbnails=False)
@@ -1,8 +1,9 @@
+import re
+
 from django.conf.urls import url
 from django.conf import settings
-from django.conf.urls.static import static
 
-from . import views
+from . import assets, views
 
 app_name = "website"
 urlpatterns = [
@@ -20,6 +21,7 @@ urlpatterns = [
     url(r'^delete_payment_type$', views.delete_payment_type, name='delete_payment_type'),
     url(r'^add_to_cart/(?P<trip_id>[0-9]+)/$', views.add_trip_to_order, name='add_trip_to_order'),
     url(r'^cart$', views.view_cart, name='cart'),
+    url(r'^cart/bulk$', views.bulk_update_cart, name='bulk_update_cart'),
     url(r'^checkout/(?P<order_id>[0-9]+)/$', views.complete_order_add_payment, name='checkout'),
     url(r'^order_confirmation$', views.order_confirmation, name='order_confirmation'),
     url(r'^delete_trip_from_cart$', views.delete_trip_from_cart, name='delete_trip_from_cart'),
@@ -31,8 +33,18 @@ urlpatterns = [
     url(r'^remove_trip_from_wishlist$', views.remove_trip_from_wishlist, name='remove_trip_from_wishlist'),
     url(r'^review_trip$', views.review_trip, name='review_trip'),
     url(r'^trip_reviews/(?P<trip_id>[0-9]+)/$', views.trip_reviews, name='trip_reviews'),
+    url(r'^metrics$', views.metrics, name='metrics'),
+    url(r'^orders/export$', views.export_orders, name='export_orders'),
+    url(r'^sales$', views.sales_dashboard, name='sales_dashboard'),
 ]
 
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Fingerprinted, precompressed files; see website/assets.py. Under runserver with
+# DEBUG on, staticfiles answers STATIC_URL itself before these are reached.
+urlpatterns += [
+    url(r'^{}(?P<path>.+)$'.format(re.escape(settings.STATIC_URL.lstrip('/'))), assets.serve,
+        {'root_setting': 'STATIC_ROOT'}),
+    url(r'^{}(?P<path>.+)$'.format(re.escape(settings.MEDIA_URL.lstrip('/'))), assets.serve,
+        {'root_setting': 'MEDIA_ROOT'}),
+]
 
@@ -1,27 +1,48 @@
 from django.contrib.auth import logout, login, authenticate
-from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseRedirect, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, redirect
 from django.template import RequestContext
+from django.template.loader import render_to_string
 from django.core.exceptions import ObjectDoesNotExist
+from django.views.decorators.http import require_POST
 from django.views.generic import TemplateView
-from django.core.exceptions import MultipleObjectsReturned
 from django.contrib.auth.models import User
-from datetime import datetime
-
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from decimal import Decimal, InvalidOperation
+import datetime
+import json
+
+from website import metrics as performance_metrics, order_export, reviews, sales
+from website.catalog_cache import anonymous_page_cache, attach_versions, trip_scope
+from website.cart import (
+    InvalidCartChange, add_to_cart, apply_cart_changes, cart_state, order_total,
+    parse_cart_changes, remove_line, summarize_order,
+)
+from website.cart_session import forget_cart, get_cart_order, remember_cart
+from website.checkout import confirm_order
+from website.inventory import SoldOut
 from website.forms import UserForm, PaymentTypeForm, OrderForm, TripReviewForm
-from website.models import Trip, TripType, PaymentType, Order, TripOrder, Customer, WishList, TripReview
-from django.db.models import Q
+from website.models import (
+    Trip, TripType, PaymentType, Order, TripOrder, Customer, WishList, TripReview, DailySellerSales, DailyTripSales,
+    DailyTripTypeSales,
+)
+from website.pagination import InvalidCursor, iterate_in_pages, keyset_page
+from website.search import search_trips
 
 # standard Django view: query, template name, and a render method to render the data from the query into the template
 
+@anonymous_page_cache(['catalog'])
 def index(request):
     """
     Purpose: renders the index page with a list of 20 (max) trips
     Args: request -- the full HTTP request object
     Returns: rendered view of the index page, with a list of trips
     """
-    all_trips = Trip.objects.all().order_by('-id')[:15]
+    all_trips = attach_versions(Trip.objects.all().order_by('-id')[:15])
     template_name = 'index.html'
     return render(request, template_name, {'trips': all_trips})
 
@@ -106,19 +127,79 @@ def user_logout(request):
     return HttpResponseRedirect('/')
 
 
+TRIP_LIST_ORDERINGS = {
+    'id': ('id',),
+    'title': ('title', 'id'),
+}
+
+# Marks where the streamed trip cards are spliced into the rendered list.html.
+TRIP_GRID_MARKER = '<!-- trip-grid -->'
+
+
+@anonymous_page_cache(['catalog'])
 def list_trips(request):
     """
-    Purpose: to render a view with a list of all trips
+    Purpose: to render a view with a page of trips, or with every trip when streaming
     Args: request -- the full HTTP request object
+        GET 'order' -- 'id' (default) or 'title'
+        GET 'cursor' -- the cursor of the page to show, taken from the previous page's next link
+        GET 'page_size' -- number of trips per page, capped at TRIP_LIST_MAX_PAGE_SIZE
+        GET 'min_rating' -- only list trips whose average review rating is at least this
+        GET 'stream' -- when '1', stream the whole catalog instead of one page
     Returns: a rendered view of a list of trips
     """
-    all_trips = Trip.objects.all()
+    order = request.GET.get('order', 'id')
+    if order not in TRIP_LIST_ORDERINGS:
+        order = 'id'
+    ordering = TRIP_LIST_ORDERINGS[order]
     template_name = 'list.html'
-    return render(request, template_name, {'trips': all_trips})
 
+    trips = Trip.objects.all()
+    min_rating = request.GET.get('min_rating')
+    if min_rating:
+        try:
+            trips = trips.filter(rating_average__gte=Decimal(min_rating))
+        except InvalidOperation:
+            min_rating = None
+
+    stream = request.GET.get('stream', '1' if settings.TRIP_LIST_STREAMING else '0') == '1'
+    if stream:
+        return StreamingHttpResponse(_stream_trip_list(request, template_name, trips, ordering, order))
+
+    try:
+        page_size = int(request.GET.get('page_size', settings.TRIP_LIST_PAGE_SIZE))
+    except ValueError:
+        page_size = settings.TRIP_LIST_PAGE_SIZE
+    page_size = max(1, min(page_size, settings.TRIP_LIST_MAX_PAGE_SIZE))
+
+    try:
+        page = keyset_page(trips, ordering, request.GET.get('cursor'), page_size)
+    except InvalidCursor:
+        raise Http404('Invalid page cursor')
+
+    attach_versions(page.items)
+    context = {'trips': page, 'page': page, 'order': order, 'page_size': page_size, 'min_rating': min_rating}
+    return render(request, template_name, context)
 
 
+def _stream_trip_list(request, template_name, trips, ordering, order):
+    """
+    Purpose: yield list.html piece by piece, rendering the trip grid one chunk of trips at a time
+    Args: request -- the full HTTP request object, template_name -- the page template,
+        trips -- the trips to list, ordering -- (tuple) the keyset ordering, order -- the name of that ordering
+    Returns: (generator) chunks of HTML
+    """
+    page_html = render_to_string(template_name, {'streaming': True, 'order': order}, request=request)
+    head, tail = page_html.split(TRIP_GRID_MARKER, 1)
+    yield head
+    for chunk in iterate_in_pages(trips, ordering, settings.TRIP_LIST_STREAM_CHUNK_SIZE):
+        yield render_to_string('trip_cards.html', {'trips': attach_versions(chunk)}, request=request)
+    yield tail
+
 
+
+
+@anonymous_page_cache(lambda trip_id: [trip_scope(trip_id), 'trip_types'])
 def single_trip(request, trip_id):
     """
     Purpose: Allows user to view trip_detail view, which contains a very specific view
@@ -154,16 +235,35 @@ def single_trip(request, trip_id):
 
 def trip_reviews(request, trip_id):
     """
-    Purpose: Allows user to view reviews for a trip
+    Purpose: Allows user to view reviews for a trip, newest first, one page at a time
     Args: trip_id: (integer): id of trip we are viewing reviews for
+        GET 'cursor' -- the cursor of the page to show, taken from the previous page's next link
     Returns: (render): a view of the request, template to use, and trip obj
     """    
 
-    trip = Trip.objects.get(pk=trip_id)
-    review_list = TripReview.objects.filter(trip=trip_id)
-    template_name = 'review_list.html' 
+    trip = get_object_or_404(Trip.objects.only('id', 'title'), pk=trip_id)
+    cursor = request.GET.get('cursor')
 
-    return render(request, template_name, {"review_list": review_list})   
+    # The first page is what almost every visitor sees, so keep it rendered in the cache.
+    # website.signals drops the entry whenever one of the trip's reviews is written.
+    cache_key = reviews.first_page_cache_key(trip.id)
+    cached = None if cursor else cache.get(cache_key)
+    if cached is not None:
+        reviews_html, next_cursor = cached
+    else:
+        queryset = TripReview.objects.filter(trip=trip).select_related('trip', 'customer')
+        try:
+            page = keyset_page(queryset, ('-id',), cursor, settings.TRIP_REVIEWS_PAGE_SIZE)
+        except InvalidCursor:
+            raise Http404('Invalid page cursor')
+        reviews_html = render_to_string('review_items.html', {'review_list': page})
+        next_cursor = page.next_cursor
+        if not cursor:
+            cache.set(cache_key, (reviews_html, next_cursor), settings.TRIP_REVIEWS_CACHE_TIMEOUT)
+
+    template_name = 'review_list.html' 
+    context = {"trip": trip, "reviews_html": reviews_html, "next_cursor": next_cursor}
+    return render(request, template_name, context)
 
 
 @login_required(login_url='/login')
@@ -173,7 +273,8 @@ def user_wishlist(request):
     Args: request -- the full HTTP request object
     Returns: List of trips on the current user's wishlist
     """
-    user_wishlist = WishList.objects.filter(customer = request.user)
+    # The template shows each entry's trip; join it rather than fetch it once per entry.
+    user_wishlist = WishList.objects.filter(customer = request.user).select_related('trip')
     template_name = 'user_wishlist.html'
     return render(request, template_name, {"user_wishlist": user_wishlist})
 
@@ -194,6 +295,7 @@ def remove_trip_from_wishlist(request):
         return HttpResponseRedirect('/user_wishlist')    
 
 
+@anonymous_page_cache(['catalog'])
 def list_trip_types(request):
     """
     Purpose: To retrieve a list of all trips & trip_types from
@@ -203,14 +305,11 @@ def list_trip_types(request):
     Returns: Combines a given template with a given context dictionary and 
     returns an HttpResponse object with that rendered text.
     """
-    trip_types = TripType.objects.all().order_by('-pk')
-
-    for tt in trip_types:
-        tt.num_trips = tt.trip_set.filter(trip_type=tt.id).count()
-        tt.trips = tt.trip_set.filter(trip_type=tt.id).order_by('-pk')[:3]
+    trip_types = TripType.objects.order_by('-pk').with_trip_counts().with_latest_trips(3)
 
     return render(request, 'trip_types.html', {'trip_types': trip_types})
 
+@anonymous_page_cache(['catalog'])
 def get_trip_types(request, type_id):
     """
     Purpose: To allow a hyperlink to a specific URL (with the parameter type_id)
@@ -221,7 +320,7 @@ def get_trip_types(request, type_id):
     returns an HttpResponse object with that rendered text.
     """
     trip_types = TripType.objects.all().filter(pk=type_id)
-    trips_of_type = Trip.objects.all().filter(trip_type=type_id)
+    trips_of_type = attach_versions(Trip.objects.all().filter(trip_type=type_id))
 
     context = { 'trip_types' : trip_types, 'trips_of_type' : trips_of_type }
     
@@ -308,24 +407,21 @@ def delete_payment_type(request):
 @login_required(login_url='/login')
 def add_trip_to_order(request, trip_id):
     """
-    Purpose: To add a trip (by the trip id) to the TripOrder table.
+    Purpose: To add a trip (by the trip id) to the TripOrder table, or book one more seat on its line
+    if it is already in the cart, holding the seat for the cart.
     Args: trip_id - the id of the trip to be added to the cart, request --the full HTTP request object 
-    Returns: Redirects user to their shopping cart after a successful add
+    Returns: Redirects user to their shopping cart after a successful add, or a sold out page (HTTP 409)
+    when no seat is free
     """
-    trip_to_add = Trip.objects.get(pk=trip_id)
+    trip_to_add = get_object_or_404(Trip, pk=trip_id)
+    new_order = get_cart_order(request)
 
     try:
-        customer = request.user
-        new_order = Order.objects.get(customer=customer, active=1)
-    except ObjectDoesNotExist:
-        customer = request.user
-        new_order = Order.objects.create(customer=customer, order_date=None, payment_type=None, active=1)
-
-    if trip_to_add.quantity <= 0:
-        pass
-    elif trip_to_add.quantity > 0:
-        add_to_TripOrder = TripOrder.objects.create(trip=trip_to_add, order=new_order)
+        add_to_cart(new_order, trip_to_add)
+    except SoldOut as sold_out:
+        return render(request, 'sold_out.html', {'sold_out_trips': sold_out.trips, 'adding_to_cart': True}, status=409)
 
+    remember_cart(request, new_order)
     return HttpResponseRedirect('/cart')
 
 
@@ -336,34 +432,50 @@ def view_cart(request):
     Args: request --the full HTTP request object
     Returns: A list of the trips added to a shopping cart and their total
     """
-    total = 0
+    order = get_cart_order(request)
+    summary = summarize_order(order)
+    remember_cart(request, order, sum(item.quantity for item in summary.items))
 
-    try:
-        customer = request.user
-        order_id = Order.objects.get(customer=customer, active=1).id
-    except ObjectDoesNotExist:
-        customer = request.user
-        order_id = Order.objects.create(customer=customer, order_date=None, payment_type=None, active=1)
+    return render(request, 'cart.html', { 'trips_in_cart' : summary.items, 'total' : summary.total, 'orderid' : order.id } )
 
+@login_required(login_url='/login')
+@require_POST
+def bulk_update_cart(request):
+    """
+    Purpose: To add and remove many trips in the customer's cart with one request
+    Args: request -- the full HTTP request object, whose JSON body is a list of changes such as
+        [{"trip_id": 3, "qty": 2}, {"trip_id": 7, "qty": -1}]; a negative qty removes that many
+    Returns: JSON describing the cart after the changes. Invalid changes get HTTP 400 and sold out
+    trips HTTP 409; in both cases the cart is left unchanged.
+    """
     try:
-        trips_in_cart = TripOrder.objects.all().filter(order=order_id)
-    except:
-        return render(request, 'cart.html', { 'total' : total, 'orderid' : order_id } )
+        deltas = parse_cart_changes(json.loads(request.body.decode('utf-8')))
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
 
-    for trip in trips_in_cart:
-        total += trip.trip.price
+    order = get_cart_order(request)
+    try:
+        apply_cart_changes(order, deltas)
+    except InvalidCartChange as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    except SoldOut as sold_out:
+        return JsonResponse({'error': 'Sold out', 'sold_out': [trip.id for trip in sold_out.trips]}, status=409)
 
-    return render(request, 'cart.html', { 'trips_in_cart' : trips_in_cart, 'total' : total, 'orderid' : order_id } )
+    state = cart_state(order)
+    remember_cart(request, order, sum(item['qty'] for item in state['items']))
+    return JsonResponse(state)
 
 @login_required(login_url='/login')
 def complete_order_add_payment(request, order_id):
     """
     purpose: Allows user to add a payment type to their order and therefore complete and place the order
     args: request --the full HTTP request object, order_id - passed to this method from the view_cart method 
-    returns: a checkout page where the user sees their order total and can select a payment type for their order
+    returns: a checkout page where the user sees their order total (computed from the order, not posted by the browser)
+    and can select a payment type for their order
     """
     if request.method == 'POST':
-        total = request.POST['total']
+        order = get_object_or_404(Order, pk=order_id, customer=request.user, active=True)
+        total = order_total(order)
         adding_payment_types = PaymentType.objects.filter(customer = request.user)
 
         template_name = 'checkout.html'
@@ -373,77 +485,65 @@ def complete_order_add_payment(request, order_id):
 def order_confirmation(request):
     """
     purpose: To mark an order as finished by setting the active field as 0 and writing the 
-    payment type used for the order to the database.
+    payment type used for the order to the database, taking stock for its trips in the same transaction.
     args: request --the full HTTP request object
-    returns: renders the order confirmation table after a successful order completion
+    returns: renders the order confirmation table after a successful order completion, or
+    a sold out page (HTTP 409) listing the trips that ran out, in which case nothing is changed
     """
     if request.method == 'POST':
 
-        current_customer = request.user.id
-        current_user = User.objects.get(pk=current_customer)
-
         payment_type_id = request.POST['payment_type_id']
         order_id = request.POST['order_id']
 
-        trips_on_order = TripOrder.objects.values_list('trip', flat=True).filter(order=order_id)
-        for each_trip in trips_on_order:
-            tripid = Trip.objects.get(pk=each_trip)
-            tripid.quantity = tripid.quantity - 1
-            tripid.quantity_sold = tripid.quantity_sold + 1
-            tripid.save()
-
-
-        completed_order = Order.objects.get(pk=order_id)
-        completed_order.payment_type = PaymentType.objects.get(pk=payment_type_id)
-        completed_order.active = False
-        completed_order.order_date = datetime.now()
-        completed_order.save()        
-
-        return render(request, 'order_confirmation.html' , {'trips_on_order' : trips_on_order})
+        try:
+            completed_order = confirm_order(order_id, request.user, payment_type_id)
+        except (Order.DoesNotExist, PaymentType.DoesNotExist):
+            raise Http404('No such open order or payment type')
+        except SoldOut as sold_out:
+            return render(request, 'sold_out.html', {'sold_out_trips': sold_out.trips}, status=409)
+
+        forget_cart(request)
+        return render(request, 'order_confirmation.html' , {'order' : completed_order})
         
 @login_required(login_url='/login')
 def delete_trip_from_cart(request):
     """
-    Purpose: to remove a specific trip from the shopping cart on the browser, as well as in the Order table
-    Args: request -- the full HTTP request object, trip_id - the id of the selected trip thats going to be deleted
+    Purpose: to remove a specific trip (all seats of it) from the shopping cart on the browser, as well as in the Order table
+    Args: request -- the full HTTP request object, the_id - the id of the cart line thats going to be deleted
     Returns: an updated shopping cart without the selected trip
     """
     if request.method == 'POST':
-        deleted_trip = request.POST['trip_id']
-        order_for_deletion = request.POST['order_id']
+        order_for_deletion = get_object_or_404(Order, pk=request.POST['order_id'], customer=request.user, active=True)
         the_id = request.POST['the_id']
 
-        try:
-            TripOrder.objects.get(trip=deleted_trip, order=order_for_deletion, pk=the_id).delete()
-        except MultipleObjectsReturned:
-            multiple_trips = TripOrder.objects.all().filter(trip=deleted_trip, order=order_for_deletion).delete()
+        remove_line(order_for_deletion, the_id)
+        remember_cart(request, order_for_deletion)
 
         return HttpResponseRedirect('/cart')
 
 @login_required(login_url='/login')
 def view_cancel_order(request):
     """
-    Purpose: to cancel an order and remove it from the database
+    Purpose: to cancel an order and remove it from the database; deleting the order releases its seat holds
     Args: request -- the full HTTP request object
     Returns: an updated Order table, without the specific order that has been cancelled
     """
     deleted_order = request.POST.get('order_id')
     Order.objects.get(id=deleted_order).delete()
+    forget_cart(request)
 
     return render(request, 'final_order_view.html' , {})
 
 
 def search(request):
     """
-    Purpose: Search for a trip by title or location using search bar in nav.
+    Purpose: Search for a trip by title, location or description using search bar in nav.
     Args: request -- the full HTTP request object
-    Returns: List of trips matching search parameters entered by user.
+    Returns: List of trips matching search parameters entered by user, most relevant first.
     """
-    all_trips = Trip.objects.all().order_by("title")
     query = request.GET.get("q")
     if query:
-        trips = all_trips.filter(
-            Q(title__contains=query) | Q(location__contains=query)).distinct() 
+        trips = search_trips(query)
         return render(request, 'query_results.html', {'search': trips})
     
     return render(request, 'query_results.html', {})
@@ -458,16 +558,11 @@ def view_order_detail(request, order_id):
     Returns: a view of order's details (trips on the order and total cost)
     """
 
-    total = 0
-
-    trips_in_cart = TripOrder.objects.all().filter(order=order_id)
-
-    for each_item in trips_in_cart:
-        total += each_item.trip.price
+    order = get_object_or_404(Order, pk=order_id, customer=request.user)
+    summary = summarize_order(order)
 
     template_name = 'order_detail.html'
-    order = get_object_or_404(Order, pk=order_id)            
-    return render(request, template_name, {"order": order, "total": total, "trips_in_cart": trips_in_cart})
+    return render(request, template_name, {"order": order, "total": summary.total, "trips_in_cart": summary.items})
 
 
 @login_required(login_url='/login')
@@ -530,8 +625,72 @@ def review_trip(request):
             return HttpResponse('Failure Submitting Form')      
 
 
+def metrics(request):
+    """
+    Purpose: Export the request and cache metrics for Prometheus to scrape
+    Args: request -- the full HTTP request object
+    Returns: the metrics in the Prometheus text format; a 404 unless the request carries
+    METRICS_TOKEN as a bearer token or comes from a logged-in staff member
+    """
+    token = settings.METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not request.user.is_staff and not (token and constant_time_compare(authorization, 'Bearer ' + token)):
+        raise Http404
+    return HttpResponse(performance_metrics.render(), content_type=performance_metrics.CONTENT_TYPE)
 
 
+@user_passes_test(lambda user: user.is_staff, login_url='/login')
+def export_orders(request):
+    """
+    Purpose: Stream every placed order with its lines, payment type and totals, for finance
+    Args: request -- the full HTTP request object; GET format ('csv' or 'jsonl') and the optional
+        date range since (included) and before (excluded), each YYYY-MM-DD or an ISO date and time
+    Returns: the export as a streamed file download; staff only
+    """
+    format_name = request.GET.get('format', 'csv')
+    if format_name not in order_export.FORMATS:
+        return HttpResponse('Unknown format {}'.format(format_name), status=400)
+    try:
+        start = order_export.parse_bound(request.GET['since']) if request.GET.get('since') else None
+        end = order_export.parse_bound(request.GET['before']) if request.GET.get('before') else None
+    except ValueError as error:
+        return HttpResponse(str(error), status=400)
 
+    response = StreamingHttpResponse(
+        order_export.export_chunks(format_name, start, end), content_type=order_export.CONTENT_TYPES[format_name])
+    response['Content-Disposition'] = 'attachment; filename="orders.{}"'.format(format_name)
+    return response
 
 
+@user_passes_test(lambda user: user.is_staff, login_url='/login')
+def sales_dashboard(request):
+    """
+    Purpose: Show staff the revenue and seats sold per day, trip type, seller and trip, read from the sales rollups
+    Args: request -- the full HTTP request object; GET days -- how many days back to show, one of SALES_DASHBOARD_DAYS
+    Returns: the rendered dashboard
+    """
+    try:
+        days = int(request.GET.get('days', settings.SALES_DASHBOARD_DEFAULT_DAYS))
+    except ValueError:
+        days = settings.SALES_DASHBOARD_DEFAULT_DAYS
+    if days not in settings.SALES_DASHBOARD_DAYS:
+        days = settings.SALES_DASHBOARD_DEFAULT_DAYS
+    end = timezone.localdate()
+    start = end - datetime.timedelta(days=days - 1)
+
+    daily = sales.daily_totals(start, end)
+    context = {
+        'days': days,
+        'day_choices': settings.SALES_DASHBOARD_DAYS,
+        'start': start,
+        'end': end,
+        'daily': daily,
+        'total_units': sum(row['units'] for row in daily),
+        'total_revenue': sum((row['revenue'] for row in daily), Decimal('0.00')),
+        'rankings': [
+            ('Trip types', sales.ranking(DailyTripTypeSales, 'trip_type__trip_type_name', start, end)),
+            ('Sellers', sales.ranking(DailySellerSales, 'seller__username', start, end)),
+            ('Trips', sales.ranking(DailyTripSales, 'trip__title', start, end)),
+        ],
+    }
+    return render(request, 'sales_dashboard.html', context)